@@ -0,0 +1,73 @@
+"""Throughput of the single-pass comment lexer against the previous regex stripper.
+
+On the 1000 samples per language, five runs gave these speedups of the lexer:
+go 1.06x-1.38x, java 1.32x-2.08x, javascript 1.09x-1.67x, php 1.43x-2.33x,
+python 1.11x-2.40x and ruby 0.88x-1.23x. Ruby is about as fast as the regex
+and sometimes slower, since the regex only strips "#" comments while the
+lexer also has to skip the strings. The runs vary that much even as the
+fastest of REPEAT passes in CPU time, so compare runs on the same machine.
+
+Run from the repository root:
+    python -m benchmarks.comment_removal
+"""
+import os
+import time
+
+import pandas as pd
+import regex as re
+
+from src.utils.language_utils import get_language_util
+
+LANGUAGES = ['go', 'java', 'javascript', 'php', 'python', 'ruby']
+REPEAT = 11
+
+
+def remove_comments_regex(x, language):
+    """Previous GenerateDocumentation.remove_comments_from_code, kept as baseline"""
+    if language == "python":
+        x = re.sub(re.compile("'''.*?'''", re.DOTALL), "", x)
+        x = re.sub(re.compile('""".*?"""', re.DOTALL), "", x)
+        x = re.sub(re.compile("(?<!(['\"]).)#[^\n]*?\n"), "\n", x)
+    elif language == "php":
+        x = re.sub(re.compile("/\*.*?\*/", re.DOTALL), "", x)
+        x = re.sub(re.compile("\/\/[a-zA-Z0-9]+\n{1}"), "\n", x)
+        x = re.sub(re.compile("#[a-zA-Z0-9]+\n{1}"), "\n", x)
+    elif language == 'ruby':
+        x = re.sub(re.compile("(?<!(['\"]).)#[^\n]*?\n"), "\n", x)
+    elif language == 'go':
+        x = re.sub(re.compile("\/\/[a-zA-Z0-9]+\n{1}"), "\n", x)
+    elif language == 'javascript':
+        x = re.sub(re.compile("\/\/[ a-zA-Z0-9]"), "\n", x)
+        x = re.sub(re.compile("/\*.*?\*/", re.DOTALL), "", x)
+    elif language == "java":
+        x = re.sub(re.compile("/\*.*?\*/", re.DOTALL), "", x)
+        x = re.sub(re.compile("\/\/[a-zA-Z0-9]+\n{1}"), "\n", x)
+    return x
+
+
+def measure(strip, codes) -> float:
+    """Fastest of REPEAT passes in CPU seconds, so other load on the machine does not skew the speedup"""
+    fastest = float('inf')
+    for _ in range(REPEAT):
+        start = time.process_time()
+        for code in codes:
+            strip(code)
+        fastest = min(fastest, time.process_time() - start)
+    return fastest
+
+
+def main():
+    print(f"{'language':<12}{'functions':>10}{'MB':>8}{'regex MB/s':>12}{'lexer MB/s':>12}{'speedup':>9}")
+    for language in LANGUAGES:
+        samples_path = os.sep.join(['data', 'raw', 'samples_' + language + '.xlsx'])
+        codes = pd.read_excel(samples_path)['code'].astype(str).tolist()
+        megabytes = sum(len(code) for code in codes) / 1e6
+        language_util = get_language_util(language)
+        regex_time = measure(lambda code: remove_comments_regex(code, language), codes)
+        lexer_time = measure(language_util.remove_comments, codes)
+        print(f"{language:<12}{len(codes):>10}{megabytes:>8.2f}{megabytes / regex_time:>12.2f}"
+              f"{megabytes / lexer_time:>12.2f}{regex_time / lexer_time:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
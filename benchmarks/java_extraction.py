@@ -0,0 +1,74 @@
+"""Files/s of the Java comment lexer and method extractor on large sources.
+
+Without --paths, large files are built from the Java samples by wrapping
+--methods_per_file of them into one class each.
+
+Run from the repository root:
+    python -m benchmarks.java_extraction --paths /path/to/java/repo --repeat 3
+"""
+import argparse
+import glob
+import os
+import time
+
+import pandas as pd
+
+from src.utils.language_utils.comments import mask_literals
+from src.utils.language_utils.java import JavaUtils
+
+
+def sample_sources(methods_per_file):
+    """Classes of methods_per_file sample methods each"""
+    samples_path = os.sep.join(['data', 'raw', 'samples_java.xlsx'])
+    # cells of the workbook keep carriage returns escaped
+    codes = pd.read_excel(samples_path)['code'].astype(str).str.replace('_x000D_', '\r').tolist()
+    return [f"public class Samples{index} {{\n" + '\n\n'.join(codes[index:index + methods_per_file]) + "\n}\n"
+            for index in range(0, len(codes), methods_per_file)]
+
+
+def measure(function, sources, repeat):
+    """Seconds for applying function to all sources repeat times and the total length of its results of one round"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        count = sum(len(function(source)) for source in sources)
+    return time.perf_counter() - start, count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--paths", type=str, nargs='+', default=[])
+    parser.add_argument("--methods_per_file", type=int, default=250)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    java_utils = JavaUtils()
+    sources = []
+    for path in args.paths:
+        file_paths = [path] if os.path.isfile(path) else glob.glob(os.sep.join([path, '**', '*.java']), recursive=True)
+        for file_path in sorted(file_paths):
+            try:
+                with open(file_path, 'r', encoding='utf-8') as file:
+                    sources.append(file.read())
+            except (UnicodeDecodeError, OSError):
+                continue
+    if not args.paths:
+        sources = sample_sources(args.methods_per_file)
+    megabytes = sum(map(len, sources)) / 1e6
+    print(f"{len(sources)} files, {sum(source.count(chr(10)) + 1 for source in sources)} lines, {megabytes:.1f} MB")
+
+    stripped = [java_utils.remove_comments(source) for source in sources]
+    stages = [
+        ("remove_comments", java_utils.remove_comments, sources),
+        ("mask_literals", lambda source: mask_literals(source, java_utils.comment_syntax), stripped),
+        ("find_functions", java_utils.find_functions, stripped),
+        ("both", lambda source: java_utils.find_functions(java_utils.remove_comments(source)), sources),
+    ]
+    print(f"{'stage':<18}{'files/s':>10}{'MB/s':>8}")
+    for name, function, inputs in stages:
+        elapsed, _ = measure(function, inputs, args.repeat)
+        print(f"{name:<18}{len(inputs) * args.repeat / elapsed:>10.1f}{megabytes * args.repeat / elapsed:>8.2f}")
+    print("Methods found:", sum(len(java_utils.find_functions(source)) for source in stripped))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Throughput of the lexer-driven JavaScript function extractor against the previous line-based one.
+
+Files are stripped of comments first, as in FunctionSplitter, and only the
+extraction is timed. Large bundled sources (webpack/rollup output, vendored
+libraries) are the interesting case, since the line-based extractor builds
+every function by concatenating its lines.
+
+Run from the repository root:
+    python -m benchmarks.javascript_extraction --paths node_modules/yarn/lib/cli.js node_modules/rxjs/dist
+"""
+import argparse
+import glob
+import os
+import re
+import time
+
+from src.utils.language_utils.base import source_lines
+from src.utils.language_utils.javascript import JavascriptUtils
+
+
+def find_functions_line_based(source):
+    """Previous JavascriptUtils.extract_functions_from_source without the token cap, kept as baseline"""
+    functions = []
+    inside_function = False
+    has_line_with_more_open_brackets = False
+    start_line = 0
+    open_count = 0
+    close_count = 0
+    current_function = ''
+
+    def is_start_of_function(line):
+        line = re.sub("`.*`", "``", line)
+        line = re.sub("'.*'", "''", line)
+        line = re.sub("\".*\"", "\"\"", line)
+        return 'function' in line
+
+    for (line_index, line) in enumerate(source_lines(source), start=1):
+        if not inside_function and is_start_of_function(line):
+            open_count = 0
+            close_count = 0
+            start_line = line_index
+            current_function = ''
+            has_line_with_more_open_brackets = False
+            inside_function = True
+        open_count += line.count('{')
+        close_count += line.count('}')
+        if inside_function:
+            if not has_line_with_more_open_brackets:
+                has_line_with_more_open_brackets = open_count > close_count
+            current_function += line
+            if has_line_with_more_open_brackets and open_count != 0 and close_count != 0 and open_count == close_count:
+                inside_function = False
+                if line_index - start_line >= 3 and 'webpack' not in current_function:
+                    functions.append(current_function.strip())
+    return functions
+
+
+def measure(extract, sources, repeat):
+    """Seconds for extracting all sources repeat times and the number of functions of one round"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function_count = sum(len(extract(source)) for source in sources)
+    return time.perf_counter() - start, function_count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--paths", type=str, nargs='+', required=True)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    javascript_utils = JavascriptUtils()
+    sources = []
+    for path in args.paths:
+        file_paths = [path] if os.path.isfile(path) else glob.glob(os.sep.join([path, '**', '*.js']), recursive=True)
+        for file_path in sorted(file_paths):
+            try:
+                with open(file_path, 'r', encoding='utf-8') as file:
+                    sources.append(javascript_utils.remove_comments(file.read()))
+            except (UnicodeDecodeError, OSError):
+                continue
+    line_count = sum(source.count('\n') + 1 for source in sources)
+    megabytes = sum(map(len, sources)) / 1e6
+    print(f"{len(sources)} files, {line_count} lines, {megabytes:.1f} MB")
+
+    print(f"{'extractor':<12}{'functions':>10}{'lines/s':>14}{'MB/s':>8}{'speedup':>9}")
+    baseline = None
+    for name, extract in [("line-based", find_functions_line_based), ("lexer", javascript_utils.find_functions)]:
+        elapsed, function_count = measure(extract, sources, args.repeat)
+        baseline = baseline or elapsed
+        print(f"{name:<12}{function_count:>10}{line_count * args.repeat / elapsed:>14,.0f}"
+              f"{megabytes * args.repeat / elapsed:>8.2f}{baseline / elapsed:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
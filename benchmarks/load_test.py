@@ -0,0 +1,113 @@
+"""Throughput of the generation and rating requests against the local mock server.
+
+The mock server runs on the engine's event loop, so no quota is used. Engine
+options (--concurrency, --schedule, --pack_tokens, --rate_limit, ...) are the
+ones of the scripts, mock server options are described in src.utils.mock_server.
+
+Run from the repository root:
+    python -m benchmarks.load_test --language python --rows 500 --latency lognormal:0.8,0.5 --error_429 0.02
+"""
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from evaluate_via_ai import EvaluateDocumentation
+from generate_documentation import GenerateDocumentation
+from src.utils import mock_server
+from src.utils.argparser import Argparser, Arguments
+from src.utils.request_engine import RequestEngine
+from src.utils.retry import RetryPolicy
+from src.utils.tokens import order_longest_first
+
+
+def run_stage(name, engine, worker, tasks, row_count):
+    """Run tasks through the engine and print rows/s, latency percentiles and retries
+
+    Args:
+        name (str): Stage shown in the report
+        engine (RequestEngine): Engine sending to the mock server
+        worker: Coroutine function handling one task
+        tasks (list): (row id or row ids, payload) tuples
+        row_count (callable): Number of rows a task id stands for
+    """
+    engine.retries.clear()
+    engine.give_ups.clear()
+    started = {}
+    latencies = []
+    rows = 0
+
+    async def timed(task):
+        # latency of a row counts from its first attempt, so backoff is included
+        started.setdefault(task[0], time.perf_counter())
+        return await worker(task)
+
+    def on_result(task_id, result):
+        nonlocal rows
+        latencies.append(time.perf_counter() - started[task_id])
+        rows += row_count(task_id)
+
+    wall_start = time.perf_counter()
+    engine.run(timed, tasks, on_result, lambda task_id, error: None)
+    wall = time.perf_counter() - wall_start
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies else (0, 0, 0)
+    print(f"{name}: {rows} rows in {wall:.1f}s, {rows / wall:.2f} rows/s, "
+          f"latency p50 {p50:.2f}s p95 {p95:.2f}s p99 {p99:.2f}s, "
+          f"{sum(engine.retries.values())} retries, {len(engine.give_ups)} given up")
+
+
+def main():
+    parser = Argparser().parser
+    parser_load_test = parser.add_argument_group("load_test")
+    # set to -1 to use all samples
+    parser_load_test.add_argument("--rows", type=int, default=500)
+    parser_load_test.add_argument("--stages", type=str, nargs='+', default=['generate', 'rate'], choices=['generate', 'rate'])
+    mock_server.add_arguments(parser)
+    args = parser.parse_args(namespace=Arguments)
+
+    samples_path = os.sep.join(['data', 'raw', 'samples_'+args.language+'.xlsx'])
+    samples_df = pd.read_excel(samples_path)
+    if args.rows > -1:
+        samples_df = samples_df.head(args.rows)
+
+    server = mock_server.from_args(args)
+    engine = RequestEngine("mock", concurrency=args.concurrency, retry_policy=RetryPolicy(max_retries=args.max_retries),
+                           rate_limit=args.rate_limit, rpm=args.rpm, tpm=args.tpm, batch_size=args.batch_size)
+    # no response cache, every row has to go through the server
+    engine.api_base = engine.loop.run_until_complete(server.start(port=0))
+    print("Mock server on", engine.api_base)
+
+    generator = GenerateDocumentation(args, run=False)
+    evaluator = EvaluateDocumentation(args, run=False)
+    generator.engine = evaluator.engine = engine
+    generator.unpacked_fallbacks = 0
+
+    tasks = list(samples_df['code'].astype(str).items())
+    if args.schedule == 'longest_first':
+        tasks = order_longest_first(tasks, generator.MODEL)
+    try:
+        if 'generate' in args.stages:
+            if args.pack_tokens > 0:
+                packs = list(generator.pack_tasks(tasks, args.pack_tokens))
+                run_stage("generate", engine, generator.documentPacked, packs, len)
+                print("Packed responses that fell back to single requests:", generator.unpacked_fallbacks)
+            else:
+                run_stage("generate", engine, generator.documentCode, tasks, lambda row_id: 1)
+        if 'rate' in args.stages:
+            docstrings = samples_df['docstring'].astype(str)
+
+            async def rate(task):
+                row_id, code = task
+                return await evaluator.get_rating(evaluator.prepare_comment(docstrings[row_id]), code)
+
+            run_stage("rate", engine, rate, tasks, lambda row_id: 1)
+    finally:
+        engine.loop.run_until_complete(server.stop())
+        print(server.report())
+        engine.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-import multiprocessing
+import asyncio
 import os
 import re
 
@@ -6,179 +6,344 @@ import numpy as np
 import openai
 import pandas as pd
 from dotenv import load_dotenv
-from scipy import stats
 from tqdm import tqdm
 
 from src.utils.argparser import Argparser, Arguments
+from src.utils.progress_journal import ProgressJournal
+from src.utils.rating_stats import rating_matrix, rating_table
+from src.utils.request_engine import RequestEngine
+from src.utils.response_cache import ResponseCache
+from src.utils.retry import RetryPolicy
+from src.utils.tokens import order_longest_first
 
 load_dotenv()
 
+# label in front of every documentation of a batched rating prompt, the answer repeats it per score
+BATCH_LABEL = "Documentation {}:"
+BATCH_SCORE_PATTERN = re.compile(r"^\s*Documentation (\d+)\s*:\s*(\d+)", re.MULTILINE)
+
 class EvaluateDocumentation:
 
-	def get_rating(self, comment: str, code: str, n_try: int = 1):
-		openai.api_key = self.api_key
+	async def get_rating(self, comment: str, code: str):
 		data_prompt = f"""Code:
 		{code}
 
 		Documentation:
 		{comment}
 		"""
-		try:
-			completion = openai.ChatCompletion.create(model="gpt-3.5-turbo-0613",
-				temperature=0,
-				messages=[
-				{"role": "user", "content": data_prompt},
-				{"role": "user", "content": self.SECOND_PROMPT2}
-				]
-				)
-			rating = completion.choices[0].message.content
-			#print(rating)
-			digits = re.findall(r'\b\d+\b', rating)
-			return int(digits[0])
-		except:
-			if (n_try >= 10):
-				return -1
-			return self.get_rating(comment, code, n_try=n_try+1)
+		# request errors are retried with backoff by the request engine
+		completion = await self.engine.chat_completion(model="gpt-3.5-turbo-0613",
+			temperature=0,
+			messages=[
+			{"role": "user", "content": data_prompt},
+			{"role": "user", "content": self.SECOND_PROMPT2}
+			]
+			)
+		rating = completion.choices[0].message.content
+		#print(rating)
+		digits = re.findall(r'\b\d+\b', rating)
+		if len(digits) == 0:
+			return -1
+		return int(digits[0])
+
+	def parse_batched_ratings(self, response, count):
+		"""Read one score per documentation from a batched rating answer
+
+		Args:
+			response (str): Model answer with one "Documentation <n>: <score>" line per documentation
+			count (int): Number of documentations in the request
+
+		Returns:
+			list[int] | None: Scores in label order, None if the answer doesn't list each label exactly once
+		"""
+		scores = BATCH_SCORE_PATTERN.findall(response)
+		if sorted(int(number) for number, score in scores) != list(range(1, count+1)):
+			return None
+		return [int(score) for number, score in sorted(scores, key=lambda score: int(score[0]))]
+
+	async def get_batched_ratings(self, comments, code):
+		"""Rate several documentations of the same code with one request, the code is sent once
+
+		Returns:
+			list[int] | None: Score per documentation, None if the answer can't be parsed
+		"""
+		data_prompt = "Code:\n"+code+"\n"
+		for number, comment in enumerate(comments, start=1):
+			data_prompt += "\n"+BATCH_LABEL.format(number)+"\n"+comment+"\n"
+		completion = await self.engine.chat_completion(model="gpt-3.5-turbo-0613",
+			temperature=0,
+			messages=[
+			{"role": "user", "content": data_prompt},
+			{"role": "user", "content": self.SECOND_PROMPT2+" "+self.BATCH_FORMAT_PROMPT}
+			]
+			)
+		return self.parse_batched_ratings(completion.choices[0].message.content, len(comments))
+
+	def has_documentation(self, comment) -> bool:
+		"""False for empty or missing documentation cells, e.g. left by a give up, which are not rated"""
+		return not pd.isna(comment) and str(comment).strip() != ""
 
 	def prepare_comment(self, comment:str)-> str:
 		comment = str(comment).lstrip().rstrip()
 		comment = comment.split(".")[0] + "."
 		return comment
 
-	def rate_code(self, row):
-			code = row['code']
-
-			try:
-				ref_doc = self.prepare_comment(row['docstring'])
-				ref_rating = self.get_rating(ref_doc, code)
-			except KeyError as e:
-				ref_rating = -1
-
-			try:
-				pred_doc_gpt4 = self.prepare_comment(row['AI documentation GPT4'])
-				gpt_3_rating = self.get_rating(pred_doc_old, code)
-			except KeyError as e:
-				gpt_3_rating = -1
-
-			try:
-				pred_doc_gpt3_5 = self.prepare_comment(row['AI documentation'])
-				gpt_3_5_rating = self.get_rating(pred_doc_gpt3_5, code)
-			except KeyError as e:
-				gpt_3_5_rating = -1
-
-			try:
-				pred_doc_old = self.prepare_comment(row['GPT-3 documentation'])
-				gpt_4_rating = self.get_rating(pred_doc_gpt4, code)
-			except KeyError as e:
-				gpt_4_rating = -1
-			
-			return {
-				'ref': ref_rating,
-				'gpt_3': gpt_3_rating,
-				'gpt_3.5': gpt_3_5_rating,
-				'gpt_4':gpt_4_rating
-			}
-	
-	def evaluate_ratings(self, df: pd.DataFrame):
+	async def rate_code(self, task):
+		"""Rate one deduplicated (code, documentation) pair
+
+		Args:
+			task (tuple[int, str]): Pair id and code, the documentation is looked up in self.pair_comments
+		"""
+		pair_id, code = task
+		return await self.get_rating(self.pair_comments[pair_id], code)
 
-		ratings_ref = df[self.col_rating_ref]
-		ratings_gpt_3 = df[self.col_rating_gpt_3]
-		ratings_gpt_3_5 = df[self.col_rating_gpt_3_5]
-		ratings_gpt_4 = df[self.col_rating_gpt_4]
+	def rating_tasks(self, df: pd.DataFrame, is_pending):
+		"""Flatten the pending ratings of df into one task per distinct (code, documentation) pair
 
-		print('Ref, Count invalid ratings', len(ratings_ref[ratings_ref == -1]))
-		print('Pred GPT 3, Count invalid ratings', len(ratings_gpt_3[ratings_gpt_3 == -1]))
-		print('Pred GPT 3.5, Count invalid ratings', len(ratings_gpt_3_5[ratings_gpt_3_5 == -1]))
-		print('Pred GPT 4, Count invalid ratings', len(ratings_gpt_4[ratings_gpt_4 == -1]))
+		Every (row, rating column) cell with a documentation becomes a target
+		of the pair it rates. Cells rating the same pair share one request, e.g. equal
+		documentations after prepare_comment cut them to their first sentence.
 
-		ratings_ref = ratings_ref[ratings_ref > -1]
-		ratings_gpt_3 = ratings_gpt_3[ratings_gpt_3 > -1]
-		ratings_gpt_3_5 = ratings_gpt_3_5[ratings_gpt_3_5 > -1]
-		ratings_gpt_4 = ratings_gpt_4[ratings_gpt_4 > -1]
+		Args:
+			df (pd.DataFrame): Table with code and documentation columns
+			is_pending (Callable[[str], pd.Series]): Mask of the rows still missing a rating column
 
-		print('Ref', np.mean(ratings_ref))
-		print('Pred GPT 3',np.mean(ratings_gpt_3))
-		print('Pred GPT 3.5',np.mean(ratings_gpt_3_5))
-		print('Pred GPT 4',np.mean(ratings_gpt_4))
+		Returns:
+			tuple[list, dict, list]: (pair id, code) tasks, targets per pair id as (row id, rating column) lists,
+				and cells that can't be rated because their documentation column or cell is missing
+		"""
+		pair_ids = dict()
+		targets = dict()
+		unratable = []
+		self.pair_comments = []
+		for rating_col, doc_col in self.rating_columns.items():
+			pending_rows = df.index[is_pending(rating_col)]
+			if doc_col not in df.columns:
+				unratable.extend((row_id, rating_col) for row_id in pending_rows)
+				continue
+			for row_id in pending_rows:
+				if not self.has_documentation(df.at[row_id, doc_col]):
+					unratable.append((row_id, rating_col))
+					continue
+				code = df.at[row_id, 'code']
+				comment = self.prepare_comment(df.at[row_id, doc_col])
+				pair = (code, comment)
+				if pair not in pair_ids:
+					pair_ids[pair] = len(pair_ids)
+					self.pair_comments.append(comment)
+					targets[pair_ids[pair]] = []
+				targets[pair_ids[pair]].append((row_id, rating_col))
+		tasks = [(pair_id, code) for (code, comment), pair_id in pair_ids.items()]
+		return tasks, targets, unratable
+
+	def group_by_code(self, tasks):
+		"""Group (pair id, code) tasks into (group id, code) tasks rating all pairs of the same code at once
+
+		The pair ids of a group are kept in self.group_pairs.
+		"""
+		group_ids = dict()
+		self.group_pairs = []
+		for pair_id, code in tasks:
+			if code not in group_ids:
+				group_ids[code] = len(group_ids)
+				self.group_pairs.append([])
+			self.group_pairs[group_ids[code]].append(pair_id)
+		return [(group_id, code) for code, group_id in group_ids.items()]
+
+	async def rate_batched(self, task):
+		"""Rate all pairs of a group with one batched request, falling back to single ratings
+
+		For the first self.agreement_sample batched groups, the pairs are also rated
+		singly to measure how well batched and single scores agree.
+
+		Returns:
+			list[int]: Score per pair id of the group
+		"""
+		group_id, code = task
+		comments = [self.pair_comments[pair_id] for pair_id in self.group_pairs[group_id]]
+		if len(comments) == 1:
+			return [await self.get_rating(comments[0], code)]
+		ratings = await self.get_batched_ratings(comments, code)
+		if ratings is None:
+			self.batch_fallbacks += 1
+			return list(await asyncio.gather(*(self.get_rating(comment, code) for comment in comments)))
+		if self.agreement_groups < self.agreement_sample:
+			self.agreement_groups += 1
+			single_ratings = await asyncio.gather(*(self.get_rating(comment, code) for comment in comments))
+			self.agreement.extend(zip(ratings, single_ratings))
+		return ratings
+
+	def report_agreement(self):
+		"""Print how well batched scores match single scores of the same documentations"""
+		pairs = [(batched, single) for batched, single in self.agreement if batched > -1 and single > -1]
+		if len(pairs) == 0:
+			return
+		batched, single = np.array(pairs).T
+		print('Batched vs single ratings of', len(pairs), 'documentations:')
+		print('Equal', np.mean(batched == single), ', within 5 points', np.mean(np.abs(batched - single) <= 5))
+		print('Mean batched', np.mean(batched), ', mean single', np.mean(single), ', mean difference', np.mean(batched - single))
+	
+	def evaluate_ratings(self, df: pd.DataFrame):
+		"""Print invalid rating counts, means with bootstrap CIs and paired tests of all model pairs
+
+		Returns:
+			pd.DataFrame: Tidy result table, see rating_stats.rating_table
+		"""
+		columns = list(self.rating_columns)
+		ratings, valid = rating_matrix(df, columns)
+		for index, col in enumerate(columns):
+			print(col+', Count invalid ratings', int((~valid[:, index]).sum()))
 
 		#Null Hypothesis (H0): Dependent sample means (m1 and m2) are equal (m1=m2).
 		#Alternative Hypothesis (Ha): Dependent sample means (m1 and m2) are not equal (m1!=m2)
-		#print("Ref vs GPT 3.5", stats.ttest_rel(ratings_ref, ratings_gpt_3_5))
-		#print("Ref vs GPT 4", stats.ttest_rel(ratings_ref, ratings_gpt_4))
-		#print("GPT 3.5 vs GPT 4", stats.ttest_rel(ratings_gpt_3_5, ratings_gpt_4))
 		#Reject the null hypothesis if p-value <= alpha
-		#Fail to reject the null hypothesis if p-value > alpha
+		table = rating_table(df, columns, self.language, self.bootstrap_resamples, self.confidence)
+		with pd.option_context('display.max_columns', None, 'display.width', 200):
+			print(table.to_string(index=False))
+		return table
 
 
-	def __init__(self):
+	def __init__(self, args: Arguments = None, run: bool = True):
+		"""Rate all documentations of the language's documented samples
 
-		parser = Argparser().parser
-		args = parser.parse_args(namespace=Arguments)
+		Args:
+			args (Arguments): Parsed arguments, read from the command line if None
+			run (bool): Only configure prompts and columns if False, e.g. for the pipeline
+		"""
+		if args is None:
+			parser = Argparser().parser
+			args = parser.parse_args(namespace=Arguments)
 
 		self.SECOND_PROMPT = """Please rate the quality of the comment by only answering with a number between 0 and 100."""
 		self.SECOND_PROMPT2 = """Please rate the documentation for the given code by only answering with a number between 0 and 100."""
+		self.BATCH_FORMAT_PROMPT = "Rate each documentation on its own and answer with one line per documentation in the form \""+BATCH_LABEL.format(1)+" <number>\"."
 
 		self.api_key = os.getenv("OPENAI_GPT4_API_KEY")
+		self.language = args.language
+		self.bootstrap_resamples = args.bootstrap_resamples
+		self.confidence = args.confidence
+
+		self.col_rating_ref = 'Rating Ref'
+		self.col_rating_gpt_3 = 'Rating GPT 3'
+		self.col_rating_gpt_3_5 = 'Rating GPT 3.5'
+		self.col_rating_gpt_4 = 'Rating GPT 4'
+		# rating column -> documentation column it rates, a new column here adds its ratings as tasks
+		self.rating_columns = {
+			self.col_rating_ref: 'docstring',
+			self.col_rating_gpt_3: 'GPT-3 documentation',
+			self.col_rating_gpt_3_5: 'AI documentation',
+			self.col_rating_gpt_4: 'AI documentation GPT4',
+		}
+
+		if not run:
+			return
 
 		if args.generated_functions:
 			documentation_path = os.sep.join(['data', 'documented', "repo-documented_"+args.language+".xlsx"])
 		else:
 			documentation_path = os.sep.join(['data', 'documented', "documented_"+args.language+".xlsx"])
 
-		codesearch_df = pd.read_excel(documentation_path)
+		output_path = documentation_path.replace('.xlsx', '.'+args.output_format)
+		# the documentation step may have written xlsx, e.g. in an earlier run or with a different --output_format
+		if args.output_format == 'parquet' and os.path.exists(output_path):
+			codesearch_df = pd.read_parquet(output_path)
+		else:
+			codesearch_df = pd.read_excel(documentation_path)
 
 		len_df = len(codesearch_df)
 
-		self.col_rating_ref = 'Rating Ref'
-		self.col_rating_gpt_3 = 'Rating GPT 3'
-		self.col_rating_gpt_3_5 = 'Rating GPT 3.5'
-		self.col_rating_gpt_4 = 'Rating GPT 4'
+		for col in self.rating_columns:
+			if col not in codesearch_df.columns:
+				codesearch_df[col] = None
 
-		try:
-			len(codesearch_df[self.col_rating_ref])
-		except KeyError:
-			codesearch_df[self.col_rating_ref] = ""
+		journal = ProgressJournal(documentation_path.replace('.xlsx', '.evaluate.jsonl'), "gpt-3.5-turbo-0613", fsync_every=args.batch_size)
+		print("Replayed", journal.replay(codesearch_df), "journal records")
 
-		try:
-			current = codesearch_df[codesearch_df[self.col_rating_ref].isna()].index[0]
-		except:
-			filled_len = len(codesearch_df[codesearch_df[self.col_rating_ref] != ""])
-			if filled_len == len(codesearch_df):
-				print("Already finished")
-				self.evaluate_ratings(codesearch_df)
-				quit()
-			current = 0
-
-		print("START", current)
+		def is_pending(col):
+			pending = codesearch_df[col].isna() | (codesearch_df[col] == "")
+			return pending & ~codesearch_df.index.isin(journal.completed_rows(col))
+
+		pending_df = codesearch_df[np.logical_or.reduce([is_pending(col) for col in self.rating_columns])]
+		if len(pending_df) == 0:
+			print("Already finished")
+			journal.compact(codesearch_df, output_path)
+			self.evaluate_ratings(codesearch_df)
+			quit()
+
+		print("START", pending_df.index[0], "PENDING", len(pending_df))
 		if args.debug:
 			quit()
 
-		num_cores = multiprocessing.cpu_count()
-
-		while current < (len_df - 1):
-			max_index = (current+args.batch_size) -1
-			if max_index > len_df - 1:
-				max_index = len_df - 1
-			batch_df = codesearch_df.loc[current:max_index]
-			with multiprocessing.Pool(num_cores) as p:
-				rating_list = list(tqdm(p.imap(self.rate_code, ((row) for idx,row in batch_df.iterrows())), total=len(batch_df)))
-			rating_list_ref = []
-			rating_list_gpt_3 = []
-			rating_list_gpt_3_5 = []
-			rating_list_gpt_4 = []
-			for rating in rating_list:
-				rating_list_ref.append(rating['ref'])
-				rating_list_gpt_3.append(rating['gpt_3'])
-				rating_list_gpt_3_5.append(rating['gpt_3.5'])
-				rating_list_gpt_4.append(rating['gpt_4'])
-			codesearch_df.loc[current:max_index, self.col_rating_ref] = rating_list_ref
-			codesearch_df.loc[current:max_index, self.col_rating_gpt_3] = rating_list_gpt_3
-			codesearch_df.loc[current:max_index, self.col_rating_gpt_3_5] = rating_list_gpt_3_5
-			codesearch_df.loc[current:max_index, self.col_rating_gpt_4] = rating_list_gpt_4
-
-			codesearch_df.to_excel(documentation_path, index = False)
-			current = max_index
-			print("Done", current)
+		self.codesearch_df = codesearch_df
+		cache = ResponseCache(args.cache_dir, args.cache_max_mb, args.cache_max_age_days) if args.cache else None
+		retry_policy = RetryPolicy(max_retries=args.max_retries)
+		self.engine = RequestEngine(self.api_key, concurrency=args.concurrency, cache=cache, retry_policy=retry_policy,
+			rate_limit=args.rate_limit, rpm=args.rpm, tpm=args.tpm, batch_size=args.batch_size, api_base=args.api_base)
+		tasks, targets, unratable = self.rating_tasks(codesearch_df, is_pending)
+		cell_count = sum(len(cells) for cells in targets.values())
+		print("Rating", cell_count, "cells with", len(tasks), "requests,", cell_count-len(tasks), "duplicates")
+		for row_id, col in unratable:
+			codesearch_df.loc[row_id, col] = -1
+			journal.record(row_id, col, -1)
+		done_count = 0
+
+		def on_pair_result(pair_id, rating, task_id):
+			nonlocal done_count
+			for row_id, col in targets[pair_id]:
+				codesearch_df.loc[row_id, col] = rating
+				journal.record(row_id, col, rating)
+				if task_id in self.engine.retries:
+					journal.record(row_id, col+' retries', self.engine.retries[task_id])
+				done_count += 1
+
+		def on_pair_failure(pair_id, task_id):
+			for row_id, col in targets[pair_id]:
+				journal.record(row_id, col+' retries', self.engine.retries.get(task_id, 0))
+				journal.record(row_id, col+' gave up', self.engine.give_ups[task_id])
+			on_pair_result(pair_id, -1, task_id)
+
+		def on_result(pair_id, rating):
+			on_pair_result(pair_id, rating, pair_id)
+			progress.update(1)
+
+		def on_failure(pair_id, error):
+			on_pair_failure(pair_id, pair_id)
+			progress.update(1)
+
+		def on_group_result(group_id, ratings):
+			for pair_id, rating in zip(self.group_pairs[group_id], ratings):
+				on_pair_result(pair_id, rating, group_id)
+			progress.update(1)
+
+		def on_group_failure(group_id, error):
+			for pair_id in self.group_pairs[group_id]:
+				on_pair_failure(pair_id, group_id)
+			progress.update(1)
+
+		self.batch_fallbacks = 0
+		self.agreement_sample = args.agreement_sample
+		self.agreement_groups = 0
+		self.agreement = []
+		if args.batch_ratings:
+			tasks = self.group_by_code(tasks)
+			print("Batched into", len(tasks), "requests")
+		if args.schedule == 'longest_first':
+			tasks = order_longest_first(tasks)
+		progress = tqdm(total=len(tasks))
+		try:
+			if args.batch_ratings:
+				self.engine.run(self.rate_batched, tasks, on_group_result, on_group_failure)
+			else:
+				self.engine.run(self.rate_code, tasks, on_result, on_failure)
+		finally:
+			progress.close()
+			self.engine.close()
+			journal.close()
+		if args.batch_ratings:
+			print("Batched ratings that fell back to single requests:", self.batch_fallbacks)
+			self.report_agreement()
+		journal.compact(codesearch_df, output_path)
+		print("Done", done_count)
 		self.evaluate_ratings(codesearch_df)
 		#with multiprocessing.Pool(num_cores) as p:
 		#	rating_list = list(tqdm(p.imap(self.rate_code, ((row) for idx,row in codesearch_df.iterrows())), total=len(codesearch_df)))
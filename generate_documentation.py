@@ -1,4 +1,4 @@
-import multiprocessing
+import asyncio
 import os
 import random
 import sys
@@ -15,42 +15,33 @@ from joblib import Parallel, delayed
 from tqdm import tqdm
 
 from src.utils.argparser import Argparser, Arguments
+from src.utils.language_utils import remove_comments_cached
+from src.utils.near_duplicates import near_duplicate_representatives
+from src.utils.progress_journal import ProgressJournal
+from src.utils.request_engine import RequestEngine
+from src.utils.response_cache import ResponseCache
+from src.utils.retry import RetryPolicy
+from src.utils.tokens import get_encoding, order_longest_first, token_counts
 
 load_dotenv()
 
+# header in front of every function of a packed request, the response repeats it per documentation
+PACK_HEADER = "### Function {}"
+PACK_HEADER_PATTERN = re.compile(r"^\s*### Function (\d+)\s*$", re.MULTILINE)
+PACK_HEADER_TOKENS = 8
+
 class GenerateDocumentation:
 
 	#remove in-line comment from code
 	def remove_comments_from_code(self, x, language):
-		if language == "python":
-			x = re.sub(re.compile("'''.*?'''", re.DOTALL), "", x)  # Remove '''...''' comments
-			x = re.sub(re.compile('""".*?"""', re.DOTALL), "", x)  # Remove '''...''' comments
-			x = re.sub(re.compile("(?<!(['\"]).)#[^\n]*?\n"), "\n", x)  # Remove #...\n comments
-		elif language == "php":
-			x = re.sub(re.compile("/\*.*?\*/", re.DOTALL), "", x)  # Remove '''...''' comments
-			x = re.sub(re.compile("\/\/[a-zA-Z0-9]+\n{1}"), "\n", x)  # Remove #...\n comments
-			x = re.sub(re.compile("#[a-zA-Z0-9]+\n{1}"), "\n", x)  # Remove #...\n comments
-		elif language == 'ruby':
-			x = re.sub(re.compile("(?<!(['\"]).)#[^\n]*?\n"), "\n", x)  # Remove #...\n comments
-		elif language == 'go':
-			x = re.sub(re.compile("\/\/[a-zA-Z0-9]+\n{1}"), "\n", x)  # Remove #...\n comments
-		elif language == 'javascript':
-			x = re.sub(re.compile("\/\/[ a-zA-Z0-9]"), "\n", x)  # Remove #...\n comments
-			x = re.sub(re.compile("/\*.*?\*/", re.DOTALL), "", x)  # Remove '''...''' comments
-		elif language == "java":
-			x = re.sub(re.compile("/\*.*?\*/", re.DOTALL), "", x)  # Remove '''...''' comments
-			x = re.sub(re.compile("\/\/[a-zA-Z0-9]+\n{1}"), "\n", x)  # Remove #...\n comments	
-		return x
-
-	def documentCode(self, data):
-		openai.api_key = self.api_key
-		row = data[0]
-		lang = data[1]
-		example_code = data[2]
-		example_doc = data[3]
-		#lang, example_code, example_doc
-		code = row['code']
-		code = self.remove_comments_from_code(code,language=lang)
+		return remove_comments_cached(x, language)
+
+	async def documentCode(self, task):
+		row_id, code = task
+		code = self.remove_comments_from_code(code,language=self.language)
+		example_code = self.example_code
+		example_doc = self.example_doc
+		lang = self.language
 		example = f"""Here is an example code:
 		{example_code}
 
@@ -68,32 +59,108 @@ class GenerateDocumentation:
 		"""
 		prompt4 = "Code:\n"+example_code+"\nDocumentation:\n"+example_doc+'\nCode:\n'+code+"\n"+"Documentation:\n"
 		zero_shot_results = dict()
-		try:
-			completion = openai.ChatCompletion.create(
+		# errors are retried with backoff by the request engine
+		completion = await self.engine.chat_completion(
+			model=self.MODEL,
+			messages=[
+			#{"role": "user", "content": example},
+			{"role": "user", "content": prompt4}
+			],
+			temperature=0.2,
+			max_tokens=256,
+			top_p=1,
+			frequency_penalty=0,
+			presence_penalty=0,
+			n = 1,
+			stop=["Code:"]
+		)
+		comment = completion.choices[0].message.content
+		#print(comment)
+		return comment
+
+	def build_packed_prompt(self, codes):
+		prompt = "Code:\n"+self.example_code+"\nDocumentation:\n"+self.example_doc+"\n\n"
+		prompt += "Document each of the following functions like in the example. "
+		prompt += "Answer with one block per function that starts with its header line, e.g. \""+PACK_HEADER.format(1)+"\", followed only by its documentation.\n"
+		for number, code in enumerate(codes, start=1):
+			prompt += PACK_HEADER.format(number)+"\n"+code+"\n"
+		return prompt
+
+	def split_packed_response(self, response, count):
+		"""Split a packed response into the documentation of each function
+
+		Args:
+			response (str): Model answer with one header per function
+			count (int): Number of functions in the request
+
+		Returns:
+			list[str] | None: Documentation per function, None if the response can't be split cleanly
+		"""
+		parts = PACK_HEADER_PATTERN.split(response)
+		# parts: [text before first header, number, documentation, number, documentation, ...]
+		numbers = [int(number) for number in parts[1::2]]
+		comments = [comment.strip() for comment in parts[2::2]]
+		if numbers != list(range(1, count+1)) or any(comment == "" for comment in comments):
+			return None
+		return comments
+
+	def pack_tasks(self, tasks, budget, known_counts=None):
+		"""Group (row id, code) tasks into ((row ids), [codes]) packs that fit the token budget
+
+		Args:
+			tasks (Iterable[tuple]): (row id, code) tasks
+			budget (int): Prompt and completion tokens per pack
+			known_counts (Mapping | None): Token count per row id kept by the function extraction, the rest is encoded
+		"""
+		tasks = list(tasks)
+		known = None if known_counts is None else [known_counts.get(row_id) for row_id, _ in tasks]
+		code_counts = token_counts([code for _, code in tasks], self.MODEL, known)
+		base_cost = len(get_encoding(self.MODEL).encode(self.build_packed_prompt([])))
+		row_ids, codes, cost = [], [], base_cost
+		for (row_id, code), code_count in zip(tasks, code_counts):
+			code_cost = code_count + PACK_HEADER_TOKENS + 256
+			if codes and cost + code_cost > budget:
+				yield tuple(row_ids), codes
+				row_ids, codes, cost = [], [], base_cost
+			row_ids.append(row_id)
+			codes.append(code)
+			cost += code_cost
+		if codes:
+			yield tuple(row_ids), codes
+
+	async def documentPacked(self, task):
+		row_ids, codes = task
+		if len(codes) > 1:
+			stripped_codes = [self.remove_comments_from_code(code,language=self.language) for code in codes]
+			completion = await self.engine.chat_completion(
 				model=self.MODEL,
 				messages=[
-				#{"role": "user", "content": example},
-				{"role": "user", "content": prompt4}
+				{"role": "user", "content": self.build_packed_prompt(stripped_codes)}
 				],
 				temperature=0.2,
-				max_tokens=256,
+				max_tokens=256*len(codes),
 				top_p=1,
 				frequency_penalty=0,
 				presence_penalty=0,
 				n = 1,
 				stop=["Code:"]
 			)
-			comment = completion.choices[0].message.content
-			#print(comment)
-			return comment
-		except Exception as e:
-			print("Error", e)
-			time.sleep(5)
-			return self.documentCode(data)
-
-	def __init__(self):
-		parser = Argparser().parser
-		args = parser.parse_args(namespace=Arguments)
+			comments = self.split_packed_response(completion.choices[0].message.content, len(codes))
+			if comments is not None:
+				return comments
+			self.unpacked_fallbacks += 1
+		return list(await asyncio.gather(*(self.documentCode(single_task) for single_task in zip(row_ids, codes))))
+
+	def __init__(self, args: Arguments = None, run: bool = True):
+		"""Document all pending functions of the language's samples
+
+		Args:
+			args (Arguments): Parsed arguments, read from the command line if None
+			run (bool): Only configure model and one-shot example if False, e.g. for the pipeline
+		"""
+		if args is None:
+			parser = Argparser().parser
+			args = parser.parse_args(namespace=Arguments)
 
 		self.api_key = os.getenv("OPENAI_GPT4_API_KEY")
 
@@ -105,6 +172,16 @@ class GenerateDocumentation:
 			self.doc_col = 'AI documentation'
 		print("USING MODEL:", self.MODEL, ",Language:", args.language)
 
+		samples_path = os.sep.join(['data', 'one_shot_examples', 'samples_OneShotExample_'+args.language+'.xlsx'])
+
+		oneshot_df = pd.read_excel(samples_path)
+		self.example_code = oneshot_df['code'].tolist()[0]
+		self.example_doc = oneshot_df['docstring'].tolist()[0]
+		self.language = args.language
+
+		if not run:
+			return
+
 		if args.generated_functions:
 			raw_path = os.sep.join(['data', 'raw', 'repo-samples_'+args.language+'.xlsx'])
 			documentation_path = os.sep.join(['data', 'documented', "repo-documented_"+args.language+".xlsx"])
@@ -121,43 +198,108 @@ class GenerateDocumentation:
 			len(codesearch_df[self.doc_col])
 		except KeyError:
 			codesearch_df[self.doc_col] = ""
-		
-		samples_path = os.sep.join(['data', 'one_shot_examples', 'samples_OneShotExample_'+args.language+'.xlsx'])
 
-		oneshot_df = pd.read_excel(samples_path)
-		example_code= oneshot_df['code'].tolist()[0]
-		example_doc = oneshot_df['docstring'].tolist()[0]
+		journal = ProgressJournal(documentation_path.replace('.xlsx', '.generate.jsonl'), self.MODEL, fsync_every=args.batch_size)
+		print("Replayed", journal.replay(codesearch_df), "journal records")
+		output_path = documentation_path.replace('.xlsx', '.'+args.output_format)
+		
+		is_pending = codesearch_df[self.doc_col].isna() | (codesearch_df[self.doc_col] == "")
+		is_pending &= ~codesearch_df.index.isin(journal.completed_rows(self.doc_col))
 
-		num_cores = multiprocessing.cpu_count()
+		duplicate_of = None
+		if args.near_duplicate_threshold > 0:
+			representatives = near_duplicate_representatives(codesearch_df['code'].tolist(), args.language, args.near_duplicate_threshold)
+			duplicate_of = pd.Series(codesearch_df.index[representatives], index=codesearch_df.index)
+			duplicate_of = duplicate_of[duplicate_of != codesearch_df.index]
+			print("Found", len(duplicate_of), "near duplicates, only their representatives are documented")
+			if 'duplicate of' not in codesearch_df.columns:
+				codesearch_df['duplicate of'] = None
+			for row_id, representative in duplicate_of.items():
+				if codesearch_df.at[row_id, 'duplicate of'] != representative:
+					codesearch_df.at[row_id, 'duplicate of'] = representative
+					journal.record(row_id, 'duplicate of', representative)
+			is_pending &= ~codesearch_df.index.isin(duplicate_of.index)
 
-		len_df = len(codesearch_df)
+		def copy_duplicate_docs():
+			# the representative's documentation is copied to its near duplicates still missing one
+			if duplicate_of is None or not args.copy_duplicate_docs:
+				return
+			copied = 0
+			for row_id, representative in duplicate_of.items():
+				comment = codesearch_df.at[representative, self.doc_col]
+				current = codesearch_df.at[row_id, self.doc_col]
+				if (pd.isna(current) or current == "") and not pd.isna(comment) and comment != "":
+					codesearch_df.loc[row_id, self.doc_col] = comment
+					journal.record(row_id, self.doc_col, comment)
+					copied += 1
+			print("Copied", copied, "documentations to near duplicates")
 
-		try:
-			current = codesearch_df[codesearch_df[self.doc_col].isna()].index[0]
-		except:
-			filled_len = len(codesearch_df[codesearch_df[self.doc_col] != ""])
-			if filled_len == len(codesearch_df):
-				print("Already finished")
-				quit()
-			current = 0
+		pending_df = codesearch_df[is_pending]
+		if len(pending_df) == 0:
+			print("Already finished")
+			copy_duplicate_docs()
+			journal.compact(codesearch_df, output_path)
+			quit()
 
-		print("START", current)
+		print("START", pending_df.index[0], "PENDING", len(pending_df))
 
 		if args.debug:
 			quit()
 
-		while current < (len_df - 1):
-			max_index = (current+args.batch_size) -1
-			if max_index > len_df - 1:
-				max_index = len_df - 1
-			batch_df = codesearch_df.loc[current:max_index]
-			with multiprocessing.Pool(num_cores) as p:
-				batch_ai_doc_list = list(tqdm(p.imap(self.documentCode, ((row, args.language,example_code, example_doc, idx) for idx,row in batch_df.iterrows())), total=len(batch_df)))
-			codesearch_df.loc[current:max_index, self.doc_col] = batch_ai_doc_list
-
-			codesearch_df.to_excel(documentation_path, index = False)
-			current = max_index
-			print("Done", current)
+		cache = ResponseCache(args.cache_dir, args.cache_max_mb, args.cache_max_age_days) if args.cache else None
+		retry_policy = RetryPolicy(max_retries=args.max_retries)
+		self.engine = RequestEngine(self.api_key, concurrency=args.concurrency, cache=cache, retry_policy=retry_policy,
+			rate_limit=args.rate_limit, rpm=args.rpm, tpm=args.tpm, batch_size=args.batch_size, api_base=args.api_base)
+		progress = tqdm(total=len(pending_df))
+		done_count = 0
+
+		def on_result(row_id, comment, retries_key=None):
+			nonlocal done_count
+			retries_key = row_id if retries_key is None else retries_key
+			codesearch_df.loc[row_id, self.doc_col] = comment
+			journal.record(row_id, self.doc_col, comment)
+			if retries_key in self.engine.retries:
+				journal.record(row_id, self.doc_col+' retries', self.engine.retries[retries_key])
+			progress.update(1)
+			done_count += 1
+
+		def on_failure(row_id, error, retries_key=None):
+			# the documentation stays empty, so the row is picked up again on the next run
+			retries_key = row_id if retries_key is None else retries_key
+			journal.record(row_id, self.doc_col+' retries', self.engine.retries.get(retries_key, 0))
+			journal.record(row_id, self.doc_col+' gave up', self.engine.give_ups[retries_key])
+			progress.update(1)
+
+		def on_packed_result(row_ids, comments):
+			for row_id, comment in zip(row_ids, comments):
+				on_result(row_id, comment, retries_key=row_ids)
+
+		def on_packed_failure(row_ids, error):
+			for row_id in row_ids:
+				on_failure(row_id, error, retries_key=row_ids)
+
+		tasks = pending_df['code'].items()
+		# token counts kept by generate_functions_from_repos.py, missing ones are encoded when needed
+		known_counts = pending_df['tokens'] if 'tokens' in pending_df.columns else None
+		if args.schedule == 'longest_first':
+			tasks = order_longest_first(tasks, self.MODEL, known_counts)
+		self.unpacked_fallbacks = 0
+		try:
+			if args.pack_tokens > 0:
+				packs = list(self.pack_tasks(tasks, args.pack_tokens, known_counts))
+				print("Packed", len(pending_df), "functions into", len(packs), "requests")
+				self.engine.run(self.documentPacked, packs, on_packed_result, on_packed_failure)
+			else:
+				self.engine.run(self.documentCode, tasks, on_result, on_failure)
+			copy_duplicate_docs()
+		finally:
+			progress.close()
+			self.engine.close()
+			journal.close()
+		journal.compact(codesearch_df, output_path)
+		if args.pack_tokens > 0:
+			print("Packed responses that fell back to single requests:", self.unpacked_fallbacks)
+		print("Done", done_count)
 
 if __name__ == "__main__":
 	GenerateDocumentation()
\ No newline at end of file
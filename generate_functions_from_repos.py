@@ -1,16 +1,22 @@
 import glob
 import os
+import queue
 import shutil
+import signal
 import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from typing import Iterable
 
-import git
-import pandas as pd
 from dotenv import load_dotenv
-from git import RemoteProgress
 from github import Github, Repository
 
-from src.utils.argparser import Argparser, Arguments
-from src.utils.split_into_functions import FunctionSplitter
+from src.utils.argparser import Argparser, Arguments, check_mining_language
+from src.utils.function_sink import FunctionSink
+from src.utils.mining_state import MiningState
+from src.utils.split_into_functions import FunctionSplitter, write_functions
 
 load_dotenv()
 REPO_PATH = os.sep.join(['repos'])
@@ -18,73 +24,176 @@ REPO_PATH = os.sep.join(['repos'])
 if not os.path.exists(REPO_PATH):
    os.makedirs(REPO_PATH)
 
-class CloneProgress(RemoteProgress):
-    def update(self, op_code, cur_count, max_count=None, message=''):
-        if message:
-            print(message)
+# suffix of the code files mined per language
+FILE_SUFFIXES = {'java': '.java', 'javascript': '.js', 'python': '.py'}
 
-def cloneRepo(repo_link: str, clone_path: str):
+class CloneCancelled(Exception):
+    """Raised by cloneRepo when the cancelled event is set while git runs"""
+
+def run_git(*arguments: str, cancelled: threading.Event = None):
+    """Run a git command, killing it as soon as cancelled is set
+
+    Raises:
+        subprocess.CalledProcessError: git failed, its error output is in stderr
+        CloneCancelled: cancelled was set before git finished
+    """
+    # git runs helpers like git-remote-https in child processes, on POSIX they are killed with it as a group
+    process = subprocess.Popen(['git', *arguments], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+                               start_new_session=os.name == 'posix')
+    while True:
+        try:
+            _, stderr = process.communicate(timeout=0.2)
+            break
+        except subprocess.TimeoutExpired:
+            if cancelled is not None and cancelled.is_set():
+                if os.name == 'posix':
+                    os.killpg(process.pid, signal.SIGKILL)
+                else:
+                    process.kill()
+                process.communicate()
+                raise CloneCancelled(' '.join(['git', *arguments]))
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, process.args, stderr=stderr)
+
+def cloneRepo(repo_link: str, clone_path: str, sparse_patterns: list[str] = None, cancelled: threading.Event = None):
     """Clone given Repository to disk
 
+    With sparse_patterns only the latest commit is cloned, without any file
+    contents, and just the files matching the patterns are downloaded by the
+    checkout. If the sparse clone fails, e.g. because the server or the local
+    git does not support it, the partial clone is removed and the full history
+    is cloned instead.
+
     Args:
-        repoLink (str)
+        repoLink (str): Clone URL or path of a local repository
         clonePath (str)
+        sparse_patterns (list[str]): gitignore-style patterns of the files to check out, None for a full clone
+        cancelled (threading.Event): Setting it stops the clone and removes what was cloned so far
+
+    Raises:
+        subprocess.CalledProcessError: The full clone failed
+        CloneCancelled: cancelled was set during the clone
     """
-    git.Repo.clone_from(repo_link, clone_path, progress=CloneProgress())
+    try:
+        if sparse_patterns is not None:
+            try:
+                sparse_clone(repo_link, clone_path, sparse_patterns, cancelled)
+                return
+            except (subprocess.CalledProcessError, OSError) as e:
+                print("Sparse clone failed, cloning the full repo:", getattr(e, 'stderr', None) or e)
+                shutil.rmtree(clone_path, ignore_errors=True)
+        run_git('clone', '--quiet', repo_link, clone_path, cancelled=cancelled)
+    except CloneCancelled:
+        shutil.rmtree(clone_path, ignore_errors=True)
+        raise
+
+def sparse_clone(repo_link: str, clone_path: str, sparse_patterns: list[str], cancelled: threading.Event = None):
+    """Shallow, blob-filtered clone that checks out only the files matching sparse_patterns"""
+    if os.path.isdir(repo_link):
+        # git ignores --depth and --filter for plain local paths, only the file:// transport honors them
+        repo_link = 'file://' + os.path.abspath(repo_link)
+    run_git('clone', '--depth', '1', '--filter=blob:none', '--no-checkout', '--quiet', repo_link, clone_path,
+            cancelled=cancelled)
+    run_git('-C', clone_path, 'sparse-checkout', 'set', '--no-cone', *sparse_patterns, cancelled=cancelled)
+    # fetches the blobs of the matching files in one batch
+    run_git('-C', clone_path, 'checkout', '--quiet', cancelled=cancelled)
+
+def code_dir(args: Arguments) -> str:
+    """Directory of a repo holding the code files of the language, None for the whole repo"""
+    if args.language == 'javascript':
+        return "src"
+    return None
+
+def sparse_patterns(args: Arguments) -> list[str]:
+    """Sparse checkout patterns of the code files find_code_files looks at, None for a full clone"""
+    if args.clone_mode == 'full':
+        return None
+    pattern = "*" + FILE_SUFFIXES.get(args.language, "")
+    dir_path = code_dir(args)
+    return [pattern] if dir_path is None else [f"/{dir_path}/**/{pattern}"]
 
 def findAllFiles(args: Arguments, repo_path: str, dir_path: str = None):
     if dir_path is None:
         root_dir = repo_path
     else:
         root_dir = os.sep.join([repo_path, dir_path])
-    file_suffix: str = ""
-    if args.language == 'java':
-        file_suffix = '.java'
-    elif args.language == 'javascript':
-        file_suffix = '.js'
-    elif args.language == 'python':
-        file_suffix = '.py'
+    file_suffix: str = FILE_SUFFIXES.get(args.language, "")
     code_files = glob.glob("**/*"+file_suffix, root_dir=root_dir, recursive=True)
     if dir_path is not None:
         code_files = map(lambda code_file: os.sep.join([dir_path, code_file]), code_files)
     return code_files
 
-def is_repo_finished(args: Arguments, repo_path: str):
-    if not os.path.isfile(f'finished_repos_{args.language}.txt'):
-        return False
-    with open(f'finished_repos_{args.language}.txt', 'r') as file:
-        content = file.read()
-        return repo_path in content
+def blob_shas(repo_path: str) -> dict[str, str]:
+    """Git blob SHA of every file of the checked-out commit by path inside the repo, empty if it is no git repo
 
-def set_repo_finished(args: Arguments, repo_path: str):
-    with open(f'finished_repos_{args.language}.txt', 'a') as file:
-        file.write(repo_path + '\n')
+    The SHAs come from the tree objects, which even a blob-filtered clone has,
+    so no file is read or downloaded for them.
+    """
+    try:
+        listing = subprocess.run(['git', '-C', repo_path, 'ls-tree', '-r', '-z', 'HEAD'],
+                                 check=True, capture_output=True).stdout
+    except (subprocess.CalledProcessError, OSError):
+        return {}
+    shas = {}
+    for entry in listing.split(b'\0'):
+        if not entry:
+            continue
+        info, path = entry.split(b'\t', 1)
+        _, object_type, sha = info.split()
+        if object_type == b'blob':
+            shas[os.fsdecode(path).replace('/', os.sep)] = sha.decode()
+    return shas
+
+def skip_duplicate_files(state: MiningState, repo_name: str, repo_path: str,
+                         code_files: list[str]) -> tuple[list[str], dict[str, str], list[str]]:
+    """Drop the files whose git blob was extracted before, in another repo or earlier in this one
+
+    Files this repo indexed in an earlier run don't count, so a resumed repo is
+    no duplicate of itself; its finished files are left to FunctionSplitter.
+
+    Returns:
+        tuple[list[str], dict[str, str], list[str]]: Files to extract, their blob SHAs and the skipped files
+    """
+    shas = blob_shas(repo_path)
+    seen = state.seen_blobs({shas[file] for file in code_files if file in shas}, exclude_repo=repo_name)
+    files, blobs, skipped = [], {}, []
+    for file in code_files:
+        sha = shas.get(file)
+        if sha is not None:
+            if sha in seen:
+                skipped.append(file)
+                continue
+            seen.add(sha)
+            blobs[file] = sha
+        files.append(file)
+    return files, blobs, skipped
+
+def files_size(repo_path: str, files: list[str]) -> int:
+    return sum(os.path.getsize(os.sep.join([repo_path, file])) for file in files)
+
+def open_mining_state(args: Arguments, sink: FunctionSink = None) -> MiningState:
+    """Open the mining progress of the language, migrating finished_repos_<lang>.txt and collected functions on first use"""
+    state = MiningState(args.language)
+    if state.is_new:
+        sink = sink or FunctionSink(args.language, args.shard_format)
+        state.import_legacy(f'finished_repos_{args.language}.txt', sink.read())
+    return state
 
 def delete_repo_files(repo_path:str, repo_name: str):
+    """Delete a clone, runs on the deleter thread of RepoMiner and the extraction thread of the pipeline"""
     try:
         preprocessed_path = os.sep.join(['preprocessed', repo_name])
         shutil.rmtree(repo_path)
         #shutil.rmtree(preprocessed_path)
     except OSError as e:
-        print("Error on deleting repo", e)
-        quit()
-
-def number_of_functions_in_xlsx(args: Arguments):
-    samples_path = os.sep.join(['data','raw', 'repo-samples_' + args.language + '.xlsx'])
-        
-    if os.path.exists(samples_path):
-        samples_df = pd.read_excel(samples_path)
-        return len(samples_df)
-    else:
-        return 0
+        # quitting would only end the thread it runs on, a leftover clone only takes up disk space
+        print("Error on deleting repo", repo_path, e)
 
-def main():
+def search_repositories(args: Arguments):
+    """Search GitHub for repos of the language matching the size and creation filters"""
     # using an github access token from your environment, can be replaced
     g = Github(os.getenv("GITHUB_API_KEY"))
 
-    parser = Argparser().parser
-    args = parser.parse_args(namespace=Arguments)
-
     search_query = f"language:{args.language} fork:false "
 
     if args.created_after != "":
@@ -102,31 +211,194 @@ def main():
     #query=f"language:{args.language} size:>{args.size_min} created:>{CREATED_AFTER} fork:false"
     res = g.search_repositories(query=search_query)
     print(f"Found {res.totalCount} matching repos")
+    return res
 
+def find_code_files(args: Arguments, repo_path: str) -> list[str]:
+    """Code files of a cloned repo, without tests, configs, type declarations and minified files"""
     unwanted_files = ['test', '.spec.', '.d.', '.config.', '.min.']
 
-    if args.language == 'javascript':
-        dir_path = "src"
-    else:
-        dir_path = None
-
-    i = 0
-    while number_of_functions_in_xlsx(args) < 1000:
-        repo = res[i]
-        repo_path = os.sep.join([REPO_PATH, repo.name])
-        if is_repo_finished(args, repo_path):
-            print(repo.name, "is finished")
-            continue
-        print("Cloning:", repo.name)
-        if not os.path.exists(repo_path):
-                cloneRepo(repo.clone_url, repo_path)
-        code_files = findAllFiles(args, repo_path, dir_path=dir_path)
-        code_files = list(filter(lambda file: not any(keyword in file for keyword in unwanted_files), code_files))
+    code_files = findAllFiles(args, repo_path, dir_path=code_dir(args))
+    return list(filter(lambda file: not any(keyword in file for keyword in unwanted_files), code_files))
+
+class RepoMiner:
+    """Mines repos with cloning, extraction and cleanup of different repos overlapping.
+
+    A feeder thread walks the search results and hands unfinished repos to
+    `--clone_workers` clone threads. They put the checked-out repos into a queue
+    of at most `--cloned_queue_size` repos, which bounds the clones on disk.
+    `--repo_workers` threads each run a FunctionSplitter on one repo and hand all
+    its functions to the writer, the thread calling `run`, which is the only one
+    writing to the sink and the mining state. Clones are deleted in the
+    background once their functions are written. Files whose git blob was
+    extracted before are skipped without being read, see skip_duplicate_files.
+
+    The writer checks the target after every repo, like the serial loop did.
+    Once it is reached, clones in flight are killed, and repos cloned or
+    extracted but not written are deleted without being marked finished, so a
+    later run mines them again.
+
+    Args:
+        args (Arguments): Parsed arguments
+        sink (FunctionSink): Shards the functions are written to
+        state (MiningState): Mining progress
+    """
+
+    def __init__(self, args: Arguments, sink: FunctionSink, state: MiningState):
+        self.args = args
+        self.sink = sink
+        self.state = state
+        self.stopped = threading.Event()
+        self.to_clone = queue.Queue(maxsize=args.clone_workers)
+        self.cloned = queue.Queue(maxsize=args.cloned_queue_size)
+        self.extracted = queue.Queue(maxsize=args.repo_workers)
+        self.deleter = ThreadPoolExecutor(1)
+        # repos of the same name share their clone path, only the first one is mined
+        self.seen_paths = set()
+
+    def run(self, repos: Iterable[Repository.Repository]):
+        """Mine repos until they are exhausted or the target is reached"""
+        started = time.perf_counter()
+        feeder = threading.Thread(target=self.feed, args=(repos,), daemon=True)
+        clone_threads = [threading.Thread(target=self.clone_worker, daemon=True) for _ in range(self.args.clone_workers)]
+        extraction_threads = [threading.Thread(target=self.extraction_worker, daemon=True)
+                              for _ in range(self.args.repo_workers)]
+        closer = threading.Thread(target=self.close_stages, args=(clone_threads, extraction_threads), daemon=True)
+        for thread in [feeder, *clone_threads, *extraction_threads, closer]:
+            thread.start()
+
+        repo_count = skipped_count = skipped_bytes = 0
+        while self.state.function_count < self.args.target_functions and (item := self.get(self.extracted)) is not None:
+            repo, repo_path, files, blobs, skipped = item
+            # repos extracted at the same time may share files the other one has written meanwhile
+            written = self.state.seen_blobs(blobs.values(), exclude_repo=repo.name)
+            skipped += [file for file, _ in files if blobs.get(file) in written]
+            files = [(file, functions) for file, functions in files if blobs.get(file) not in written]
+            write_functions(self.sink, self.state, repo.name, files, blobs)
+            self.state.set_repo_finished(repo_path)
+            size = files_size(repo_path, skipped)
+            self.delete(repo_path, repo.name)
+            repo_count += 1
+            skipped_count += len(skipped)
+            skipped_bytes += size
+            print(f"Wrote {repo.name}, skipped {len(skipped)} duplicate files ({size / 1e6:.2f} MB), "
+                  f"collected {self.state.function_count} functions so far")
+
+        self.stopped.set()
+        for thread in [feeder, *clone_threads, *extraction_threads, closer]:
+            thread.join()
+        # repos that were cloned or extracted but will not be written
+        for items in (self.cloned, self.extracted):
+            while not items.empty():
+                item = items.get_nowait()
+                if item is not None:
+                    self.delete(item[1], item[0].name)
+        self.deleter.shutdown(wait=True)
+        print(f"Mined {repo_count} repos in {time.perf_counter() - started:.1f}s, "
+              f"skipped {skipped_count} duplicate files ({skipped_bytes / 1e6:.2f} MB)")
+
+    def get(self, items: queue.Queue):
+        """Next item of a queue, None once the queue is closed or mining stopped"""
+        while not self.stopped.is_set():
+            try:
+                return items.get(timeout=0.2)
+            except queue.Empty:
+                continue
+        return None
+
+    def put(self, items: queue.Queue, item) -> bool:
+        """Put an item into a queue, waiting while it is full, False if mining stopped first"""
+        while not self.stopped.is_set():
+            try:
+                items.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def delete(self, repo_path: str, repo_name: str):
+        self.deleter.submit(delete_repo_files, repo_path, repo_name)
+
+    def feed(self, repos: Iterable[Repository.Repository]):
+        """Hand the unfinished repos to the clone workers"""
+        try:
+            for repo in repos:
+                if self.stopped.is_set():
+                    break
+                repo_path = os.sep.join([REPO_PATH, repo.name])
+                if self.state.is_repo_finished(repo_path) or repo_path in self.seen_paths:
+                    print(repo.name, "is finished")
+                    continue
+                self.seen_paths.add(repo_path)
+                if not self.put(self.to_clone, (repo, repo_path)):
+                    break
+        finally:
+            for _ in range(self.args.clone_workers):
+                self.put(self.to_clone, None)
+
+    def clone_worker(self):
+        while (item := self.get(self.to_clone)) is not None:
+            repo, repo_path = item
+            if not os.path.exists(repo_path):
+                print("Cloning:", repo.name)
+                try:
+                    cloneRepo(repo.clone_url, repo_path, sparse_patterns(self.args), self.stopped)
+                except CloneCancelled:
+                    break
+                except Exception as e:
+                    # a dead worker would leave the queues open and the writer waiting, so the repo is skipped
+                    print("Error on cloning", repo.name, getattr(e, 'stderr', None) or repr(e))
+                    shutil.rmtree(repo_path, ignore_errors=True)
+                    continue
+            if not self.put(self.cloned, item):
+                self.delete(repo_path, repo.name)
+
+    def extraction_worker(self):
+        while (item := self.get(self.cloned)) is not None:
+            repo, repo_path = item
+            try:
+                code_files, blobs, skipped = skip_duplicate_files(self.state, repo.name, repo_path,
+                                                                  find_code_files(self.args, repo_path))
+                splitter = FunctionSplitter(self.args, repo.name, repo_path, code_files)
+                files = []
+                with closing(splitter.split_files(lambda file: self.state.is_file_finished(repo.name, file))) as results:
+                    for file, functions in results:
+                        if self.stopped.is_set():
+                            break
+                        files.append((file, functions))
+            # split_files exits on a missing file, which must not end the worker either
+            except (Exception, SystemExit) as e:
+                print("Error on extracting", repo.name, repr(e))
+                self.delete(repo_path, repo.name)
+                continue
+            if self.stopped.is_set() or not self.put(self.extracted, (repo, repo_path, files, blobs, skipped)):
+                self.delete(repo_path, repo.name)
+
+    def close_stages(self, clone_threads: list[threading.Thread], extraction_threads: list[threading.Thread]):
+        """Close the queue behind each stage once all threads of the stage are done"""
+        for thread in clone_threads:
+            thread.join()
+        for _ in extraction_threads:
+            self.put(self.cloned, None)
+        for thread in extraction_threads:
+            thread.join()
+        self.put(self.extracted, None)
+
+def main():
+    parser = Argparser().parser
+    args = parser.parse_args(namespace=Arguments)
+    check_mining_language(parser, args)
+
+    res = search_repositories(args)
+    sink = FunctionSink(args.language, args.shard_format)
+    state = open_mining_state(args, sink)
+    print("Collected", state.function_count, "functions so far")
+
+    if state.function_count < args.target_functions:
+        RepoMiner(args, sink, state).run(res)
+    state.close()
 
-        FunctionSplitter(args, repo.name, repo_path, code_files)
-        set_repo_finished(args, repo_path)
-        delete_repo_files(repo_path, repo.name)
-        i = i + 1
+    if args.export_xlsx:
+        print("Exported", sink.count, "functions to", sink.export_xlsx())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,239 @@
+import asyncio
+import os
+import time
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from evaluate_via_ai import EvaluateDocumentation
+from generate_documentation import GenerateDocumentation
+from generate_functions_from_repos import (REPO_PATH, cloneRepo, delete_repo_files, files_size, find_code_files,
+                                           open_mining_state, search_repositories, skip_duplicate_files,
+                                           sparse_patterns)
+from src.utils.argparser import Argparser, Arguments, check_mining_language
+from src.utils.progress_journal import ProgressJournal
+from src.utils.request_engine import RequestEngine
+from src.utils.response_cache import ResponseCache
+from src.utils.retry import RetryPolicy
+from src.utils.split_into_functions import FunctionSplitter
+
+load_dotenv()
+
+# marks that all functions of a repo have been put into the queue
+REPO_DONE = 'repo_done'
+
+
+class Pipeline:
+    """Extract, document and rate functions as concurrent stages.
+
+    An extraction thread feeds functions into a bounded queue, documentation
+    workers take them from it and feed a second bounded queue, and rating workers
+    write every finished row to the journal. Full queues block the stage in front
+    of them, so no stage runs ahead of the others by more than `--queue_size` rows.
+    """
+
+    def __init__(self):
+        parser = Argparser().parser
+        self.args = args = parser.parse_args(namespace=Arguments)
+        if args.source == 'repos':
+            check_mining_language(parser, args)
+
+        self.generator = GenerateDocumentation(args, run=False)
+        self.evaluator = EvaluateDocumentation(args, run=False)
+        self.doc_col = self.generator.doc_col
+        self.rating_col = self.evaluator.col_rating_gpt_4 if args.gpt_4 else self.evaluator.col_rating_gpt_3_5
+
+        if args.source == 'repos':
+            output_path = os.sep.join(['data', 'documented', "pipeline-repo-documented_"+args.language+".xlsx"])
+        else:
+            output_path = os.sep.join(['data', 'documented', "pipeline-documented_"+args.language+".xlsx"])
+        self.journal = ProgressJournal(output_path.replace('.xlsx', '.pipeline.jsonl'), self.generator.MODEL, fsync_every=args.batch_size)
+
+        self.rows: Dict[Hashable, dict] = {}
+        if args.source == 'samples':
+            samples_path = os.sep.join(['data', 'raw', 'samples_'+args.language+'.xlsx'])
+            self.rows = pd.read_excel(samples_path).to_dict('index')
+        for column, values in self.journal.read_values().items():
+            for row_id, value in values.items():
+                self.rows.setdefault(row_id, {})[column] = value
+        print("Resumed", len(self.journal.completed_rows(self.rating_col)), "rated rows")
+        # journaled row ids per repo and (path, code), the extraction reuses them instead of adding the functions again
+        self.journaled: Dict[str, Dict[Tuple[str, str], List[Hashable]]] = {}
+        for row_id, row in self.rows.items():
+            if 'repo' in row and 'path' in row and 'code' in row:
+                self.journaled.setdefault(row['repo'], {}).setdefault((row['path'], row['code']), []).append(row_id)
+
+        self.state = open_mining_state(args) if args.source == 'repos' else None
+
+        # rows taken from the queue but not yet rated, per repo
+        self.outstanding: Dict[str, int] = {}
+        self.extracted_repos = set()
+        self.first_rated: Optional[float] = None
+        self.rated_count = 0
+
+        cache = ResponseCache(args.cache_dir, args.cache_max_mb, args.cache_max_age_days) if args.cache else None
+        retry_policy = RetryPolicy(max_retries=args.max_retries)
+        self.engine = RequestEngine(self.generator.api_key, concurrency=args.concurrency, cache=cache, retry_policy=retry_policy,
+            rate_limit=args.rate_limit, rpm=args.rpm, tpm=args.tpm, batch_size=args.batch_size, api_base=args.api_base)
+        self.generator.engine = self.engine
+        self.evaluator.engine = self.engine
+
+        self.started = time.monotonic()
+        try:
+            self.engine.loop.run_until_complete(self.run())
+        finally:
+            self.engine.close()
+            self.journal.close()
+            if self.state is not None:
+                self.state.close()
+        self.journal.compact(pd.DataFrame.from_dict(self.rows, orient='index'), output_path.replace('.xlsx', '.'+args.output_format))
+        self.report()
+
+    async def run(self):
+        documents = asyncio.Queue(maxsize=self.args.queue_size)
+        ratings = asyncio.Queue(maxsize=self.args.queue_size)
+        loop = asyncio.get_running_loop()
+
+        def put(item):
+            # blocks the extraction thread while the queue is full
+            asyncio.run_coroutine_threadsafe(documents.put(item), loop).result()
+
+        document_workers = [asyncio.ensure_future(self.document_worker(documents, ratings)) for _ in range(self.args.document_concurrency)]
+        rate_workers = [asyncio.ensure_future(self.rate_worker(ratings)) for _ in range(self.args.rate_concurrency)]
+
+        await loop.run_in_executor(None, self.extract, put)
+        for _ in document_workers:
+            await documents.put(None)
+        await asyncio.gather(*document_workers)
+        for _ in rate_workers:
+            await ratings.put(None)
+        await asyncio.gather(*rate_workers)
+
+    def extract(self, put):
+        """Extraction stage, runs in a thread and puts (row id, row) items into the queue"""
+        if self.args.source == 'samples':
+            for row_id, row in self.rows.items():
+                if row_id not in self.journal.completed.get(self.rating_col, ()):
+                    put((row_id, row))
+            return
+
+        row_id = max(self.rows, default=-1) + 1
+        function_count = len(self.rows)
+        for repo in search_repositories(self.args):
+            if function_count >= self.args.target_functions:
+                break
+            repo_path = os.sep.join([REPO_PATH, repo.name])
+            if self.state.is_repo_finished(repo_path):
+                print(repo.name, "is finished")
+                continue
+            print("Cloning:", repo.name)
+            if not os.path.exists(repo_path):
+                cloneRepo(repo.clone_url, repo_path, sparse_patterns(self.args))
+            journaled = self.journaled.pop(repo.name, {})
+            for row_ids in journaled.values():
+                for journaled_id in row_ids:
+                    if journaled_id not in self.journal.completed.get(self.rating_col, ()):
+                        put((journaled_id, self.rows[journaled_id]))
+            code_files, blobs, skipped = skip_duplicate_files(self.state, repo.name, repo_path,
+                                                              find_code_files(self.args, repo_path))
+            if skipped:
+                print(f"{repo.name}: skipped {len(skipped)} duplicate files ({files_size(repo_path, skipped) / 1e6:.2f} MB)")
+            splitter = FunctionSplitter(self.args, repo.name, repo_path, code_files)
+            for file, functions in splitter.split_files():
+                for code, tokens in functions:
+                    if journaled.get((file, code)):
+                        # already queued above or rated in an earlier run
+                        journaled[(file, code)].pop()
+                        continue
+                    put((row_id, {'repo': repo.name, 'path': file, 'code': code, 'tokens': tokens}))
+                    row_id += 1
+                    function_count += 1
+            # the pipeline keeps no finished files, its functions go to the journal instead of the sink
+            self.state.add_blobs(repo.name, blobs)
+            # files are read, the clone is not needed anymore
+            delete_repo_files(repo_path, repo.name)
+            put((REPO_DONE, repo_path))
+
+    async def document_worker(self, documents: asyncio.Queue, ratings: asyncio.Queue):
+        while True:
+            item = await documents.get()
+            if item is None:
+                return
+            row_id, row = item
+            if row_id == REPO_DONE:
+                self.extracted_repos.add(row)
+                self.finish_repo(row)
+                continue
+            if row_id not in self.rows:
+                self.rows[row_id] = row
+                for column in ['repo', 'path', 'code', 'tokens']:
+                    if column in row:
+                        self.journal.record(row_id, column, row[column])
+            if 'repo' in row and self.args.source == 'repos':
+                repo_path = os.sep.join([REPO_PATH, row['repo']])
+                self.outstanding[repo_path] = self.outstanding.get(repo_path, 0) + 1
+            if row_id not in self.journal.completed.get(self.doc_col, ()):
+                # every request of a row gets its own key, so each has its own retry budget and give up reason
+                task_id = (row_id, self.doc_col)
+                comment, error = await self.engine.run_with_retries(self.generator.documentCode, (task_id, row['code']))
+                if error is not None:
+                    self.journal.record(row_id, self.doc_col+' gave up', self.engine.give_ups[task_id])
+                    self.row_done(row_id)
+                    continue
+                row[self.doc_col] = comment
+                self.journal.record(row_id, self.doc_col, comment)
+            await ratings.put(row_id)
+
+    async def rate_worker(self, ratings: asyncio.Queue):
+        while True:
+            row_id = await ratings.get()
+            if row_id is None:
+                return
+            row = self.rows[row_id]
+            rated_columns = [(self.doc_col, self.rating_col)]
+            if 'docstring' in row:
+                rated_columns.append(('docstring', self.evaluator.col_rating_ref))
+            for doc_column, rating_column in rated_columns:
+                if not self.evaluator.has_documentation(row[doc_column]):
+                    # nothing to rate, scored as invalid like a rating that was given up
+                    row[rating_column] = -1
+                    self.journal.record(row_id, rating_column, -1)
+                    continue
+                comment = self.evaluator.prepare_comment(row[doc_column])
+                rate = lambda task: self.evaluator.get_rating(comment, task[1])
+                task_id = (row_id, rating_column)
+                rating, error = await self.engine.run_with_retries(rate, (task_id, row['code']))
+                row[rating_column] = rating if error is None else -1
+                if error is not None:
+                    self.journal.record(row_id, rating_column+' gave up', self.engine.give_ups[task_id])
+                self.journal.record(row_id, rating_column, row[rating_column])
+            if self.first_rated is None:
+                self.first_rated = time.monotonic()
+                print(f"First rated row after {self.first_rated - self.started:.1f}s")
+            self.rated_count += 1
+            self.row_done(row_id)
+
+    def row_done(self, row_id: Hashable):
+        repo = self.rows[row_id].get('repo')
+        if self.args.source != 'repos' or repo is None:
+            return
+        repo_path = os.sep.join([REPO_PATH, repo])
+        self.outstanding[repo_path] -= 1
+        self.finish_repo(repo_path)
+
+    def finish_repo(self, repo_path: str):
+        """Mark a repo finished once it is fully extracted and all its rows are rated"""
+        if repo_path in self.extracted_repos and self.outstanding.get(repo_path, 0) == 0:
+            self.state.set_repo_finished(repo_path)
+            self.extracted_repos.remove(repo_path)
+
+    def report(self):
+        total = time.monotonic() - self.started
+        print(f"Rated {self.rated_count} rows in {total:.1f}s ({self.rated_count / total:.2f} rows/s)")
+        if self.first_rated is not None:
+            print(f"Time to first rated row: {self.first_rated - self.started:.1f}s")
+
+
+if __name__ == "__main__":
+    Pipeline()
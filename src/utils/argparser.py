@@ -1,14 +1,52 @@
 import argparse
 from typing import Literal, TypedDict
 
+# languages whose functions can be extracted from mined repos, the others only have CodeSearchNet samples
+MINING_LANGUAGES = ['javascript', 'java', 'python']
+
+
+def check_mining_language(parser: argparse.ArgumentParser, args: argparse.Namespace):
+    """Exit with a usage error if repos can't be mined for the language, before anything is searched or cloned"""
+    if args.language not in MINING_LANGUAGES:
+        parser.error(f"mining repos is not implemented for --language {args.language}, "
+                     f"choose one of {', '.join(MINING_LANGUAGES)}")
+
+
+def similarity_threshold(value: str) -> float:
+    """Argument type of a similarity threshold, 0 turns the filter off"""
+    threshold = float(value)
+    if not 0 <= threshold <= 1:
+        raise argparse.ArgumentTypeError(f"{value} is not between 0 and 1")
+    return threshold
+
 
 class Argparser:
     def __init__(self) -> argparse.ArgumentParser:
         parser = argparse.ArgumentParser()
-        parser.add_argument('--language', type=str, required=True, choices=['javascript', 'java', 'python'])
+        parser.add_argument('--language', type=str, required=True, choices=['javascript', 'java', 'python', 'go', 'php', 'ruby'])
         parser.add_argument('--debug', default=False, type=bool)
         parser.add_argument("--generated_functions", action=argparse.BooleanOptionalAction, default=False)
         parser.add_argument("--batch_size", type=int, default=25)
+        # number of API requests kept in flight at once
+        parser.add_argument("--concurrency", type=int, default=64)
+        # retries per row for rate limits, timeouts and server errors before giving up
+        parser.add_argument("--max_retries", type=int, default=8)
+        # dispatch pending rows in table order or the most expensive prompts first
+        parser.add_argument("--schedule", type=str, default="in_order", choices=['in_order', 'longest_first'])
+        # set to -1 to use the model's default requests/tokens per minute
+        parser.add_argument("--rate_limit", action=argparse.BooleanOptionalAction, default=True)
+        parser.add_argument("--rpm", type=int, default=-1)
+        parser.add_argument("--tpm", type=int, default=-1)
+        # format of the final table written once after the run, progress is journaled meanwhile
+        parser.add_argument("--output_format", type=str, default="xlsx", choices=['xlsx', 'parquet'])
+        # set to "" to use the OpenAI API, e.g. http://127.0.0.1:8089/v1 for the local mock server
+        parser.add_argument("--api_base", type=str, default="")
+
+        parser_cache = parser.add_argument_group("response_cache")
+        parser_cache.add_argument("--cache", action=argparse.BooleanOptionalAction, default=True)
+        parser_cache.add_argument("--cache_dir", "--cache-dir", type=str, default="cache")
+        parser_cache.add_argument("--cache_max_mb", type=int, default=1024)
+        parser_cache.add_argument("--cache_max_age_days", type=float, default=30)
 
         parser_function_generator = parser.add_argument_group("function_generator")
 
@@ -18,22 +56,100 @@ class Argparser:
 
         # set to "" to ignore
         parser_function_generator.add_argument("--created_after", type=str, default="2023-01-01")
+        # mined functions are appended to one shard per repo and exported to repo-samples xlsx at the end
+        parser_function_generator.add_argument("--shard_format", type=str, default="jsonl", choices=['jsonl', 'parquet'])
+        parser_function_generator.add_argument("--export_xlsx", action=argparse.BooleanOptionalAction, default=True)
+        # processes extracting the files of a repo in parallel, set to 0 to use all cores
+        parser_function_generator.add_argument("--extraction_workers", type=int, default=1)
+        parser_function_generator.add_argument("--extraction_chunk_size", type=int, default=16)
+        # write the comment-free source of every file to preprocessed/ for debugging
+        parser_function_generator.add_argument("--keep_preprocessed", action=argparse.BooleanOptionalAction, default=False)
+        # sparse clones only the latest commit and checks out only the code files of the language, falling back to full
+        parser_function_generator.add_argument("--clone_mode", type=str, default="sparse", choices=['sparse', 'full'])
+        # repos cloned at the same time, repos extracted at the same time and checked-out repos waiting for extraction
+        parser_function_generator.add_argument("--clone_workers", type=int, default=4)
+        parser_function_generator.add_argument("--repo_workers", type=int, default=2)
+        parser_function_generator.add_argument("--cloned_queue_size", type=int, default=4)
+        # mining stops once this many functions are collected
+        parser_function_generator.add_argument("--target_functions", type=int, default=1000)
 
         parser_documentation_generator = parser.add_argument_group("documentation_generator")
         parser_documentation_generator.add_argument("--gpt_4", action=argparse.BooleanOptionalAction, default=False)
+        # token budget of one request documenting several functions, set to 0 for one function per request
+        parser_documentation_generator.add_argument("--pack_tokens", type=int, default=0)
+        # estimated Jaccard similarity of the token shingles from which functions count as near duplicates,
+        # only the first function of each cluster is documented, set to 0 to document all
+        parser_documentation_generator.add_argument("--near_duplicate_threshold", type=similarity_threshold, default=0)
+        # copy the documentation of the representative to the other functions of its cluster
+        parser_documentation_generator.add_argument("--copy_duplicate_docs", action=argparse.BooleanOptionalAction, default=True)
+
+        parser_evaluation = parser.add_argument_group("evaluation")
+        # rate all documentations of a function with one request that sends the code once
+        parser_evaluation.add_argument("--batch_ratings", action=argparse.BooleanOptionalAction, default=False)
+        # batched requests whose documentations are also rated singly to report agreement, set to 0 to skip
+        parser_evaluation.add_argument("--agreement_sample", type=int, default=50)
+        # resamples per bootstrap confidence interval of the rating statistics
+        parser_evaluation.add_argument("--bootstrap_resamples", type=int, default=2000)
+        parser_evaluation.add_argument("--confidence", type=float, default=0.95)
+
+        parser_pipeline = parser.add_argument_group("pipeline")
+        # where the pipeline takes functions from: the CodeSearchNet samples or mined GitHub repos
+        parser_pipeline.add_argument("--source", type=str, default="samples", choices=['samples', 'repos'])
+        parser_pipeline.add_argument("--queue_size", type=int, default=64)
+        parser_pipeline.add_argument("--document_concurrency", type=int, default=32)
+        parser_pipeline.add_argument("--rate_concurrency", type=int, default=32)
 
         self.parser = parser
 
 class Arguments(argparse.Namespace):
-    language: Literal['javascript', 'java', 'python']
+    language: Literal['javascript', 'java', 'python', 'go', 'php', 'ruby']
     generated_functions: bool
     batch_size: int
     debug: bool
+    concurrency: int
+    max_retries: int
+    schedule: Literal['in_order', 'longest_first']
+    rate_limit: bool
+    rpm: int
+    tpm: int
+    output_format: Literal['xlsx', 'parquet']
+    api_base: str
+
+    #argument group: response_cache
+    cache: bool
+    cache_dir: str
+    cache_max_mb: int
+    cache_max_age_days: float
 
     #argument group: function_generator
     size_min: int
     size_max: int
     created_after: str
+    shard_format: Literal['jsonl', 'parquet']
+    export_xlsx: bool
+    extraction_workers: int
+    extraction_chunk_size: int
+    keep_preprocessed: bool
+    target_functions: int
+    clone_mode: Literal['sparse', 'full']
+    clone_workers: int
+    repo_workers: int
+    cloned_queue_size: int
 
     #argument group: documentation_generator
-    gpt_4: bool
\ No newline at end of file
+    gpt_4: bool
+    pack_tokens: int
+    near_duplicate_threshold: float
+    copy_duplicate_docs: bool
+
+    #argument group: evaluation
+    batch_ratings: bool
+    agreement_sample: int
+    bootstrap_resamples: int
+    confidence: float
+
+    #argument group: pipeline
+    source: Literal['samples', 'repos']
+    queue_size: int
+    document_concurrency: int
+    rate_concurrency: int
@@ -0,0 +1,111 @@
+import glob
+import json
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+# tokens is the count kept from the extraction, empty where the cap did not need it
+COLUMNS = ['repo', 'path', 'code', 'tokens']
+
+
+class FunctionSink:
+    """Collects extracted functions in one shard per repo.
+
+    JSONL shards are appended to after every source file, Parquet shards are
+    written once per repo by `finish_repo`, since Parquet files can't be appended
+    to. The number of collected functions is counted once on start and then kept
+    up to date, so checking the mining target never reads the shards again.
+    `export_xlsx` writes the single workbook `generate_documentation.py
+    --generated_functions` reads.
+
+    Args:
+        language (str): Language of the mined functions
+        shard_format (str): 'jsonl' or 'parquet'
+        shard_dir (str): Folder of the shards, data/raw/repo-samples_<language> if None
+    """
+
+    def __init__(self, language: str, shard_format: str = 'jsonl', shard_dir: str = None):
+        self.language = language
+        self.shard_format = shard_format
+        self.shard_dir = shard_dir or os.sep.join(['data', 'raw', 'repo-samples_' + language])
+        self.xlsx_path = os.sep.join(['data', 'raw', 'repo-samples_' + language + '.xlsx'])
+        # functions of repos whose Parquet shard is written by finish_repo
+        self.buffers: Dict[str, List[dict]] = {}
+        self.count = 0
+        if not os.path.exists(self.shard_dir):
+            os.makedirs(self.shard_dir)
+            if os.path.exists(self.xlsx_path):
+                self.import_xlsx(self.xlsx_path)
+        self.count = sum(self.count_shard(shard_path) for shard_path in self.shard_paths())
+
+    def shard_path(self, repo_name: str, shard_format: str = None) -> str:
+        file_name = re.sub(r'[^\w.-]', '_', repo_name) + '.' + (shard_format or self.shard_format)
+        return os.sep.join([self.shard_dir, file_name])
+
+    def shard_paths(self) -> List[str]:
+        return sorted(glob.glob(os.sep.join([self.shard_dir, '*.jsonl'])) + glob.glob(os.sep.join([self.shard_dir, '*.parquet'])))
+
+    def count_shard(self, shard_path: str) -> int:
+        if shard_path.endswith('.parquet'):
+            return len(pd.read_parquet(shard_path, columns=['repo']))
+        with open(shard_path, 'r') as shard_file:
+            return sum(1 for _ in shard_file)
+
+    def read_shard(self, shard_path: str) -> pd.DataFrame:
+        if shard_path.endswith('.parquet'):
+            return pd.read_parquet(shard_path)
+        return pd.read_json(shard_path, lines=True, dtype=False)
+
+    def append(self, repo_name: str, path: str, function_records: List[Tuple[str, Optional[int]]]):
+        """Add the functions of one source file
+
+        Args:
+            repo_name (str): Repo the file belongs to
+            path (str): File path inside the repo
+            function_records (List[Tuple[str, Optional[int]]]): Extracted functions of the file and their token counts
+        """
+        functions = [{'repo': repo_name, 'path': path, 'code': code, 'tokens': tokens} for code, tokens in function_records]
+        if self.shard_format == 'parquet':
+            self.buffers.setdefault(repo_name, []).extend(functions)
+        else:
+            with open(self.shard_path(repo_name), 'a') as shard_file:
+                for function in functions:
+                    shard_file.write(json.dumps(function, ensure_ascii=False) + '\n')
+        self.count += len(functions)
+
+    def finish_repo(self, repo_name: str):
+        """Write the buffered functions of a repo to its Parquet shard"""
+        functions = self.buffers.pop(repo_name, None)
+        if functions:
+            pd.DataFrame(functions, columns=COLUMNS).to_parquet(self.shard_path(repo_name), index=False)
+
+    def read(self) -> pd.DataFrame:
+        """All collected functions, ordered by shard"""
+        frames = [self.read_shard(shard_path) for shard_path in self.shard_paths()]
+        if not frames:
+            return pd.DataFrame(columns=COLUMNS)
+        # shards written before token counts were kept have no tokens column
+        return pd.concat(frames, ignore_index=True).reindex(columns=COLUMNS)
+
+    def export_xlsx(self, xlsx_path: str = None) -> str:
+        """Write all collected functions to the repo-samples workbook
+
+        Returns:
+            str: Path of the workbook
+        """
+        xlsx_path = xlsx_path or self.xlsx_path
+        self.read().to_excel(xlsx_path, index=False)
+        return xlsx_path
+
+    def import_xlsx(self, xlsx_path: str):
+        """Split an existing repo-samples workbook into shards"""
+        samples_df = pd.read_excel(xlsx_path)
+        for (repo_name, path), file_df in samples_df.groupby(['repo', 'path'], sort=False):
+            tokens = file_df['tokens'] if 'tokens' in file_df.columns else pd.Series(None, index=file_df.index)
+            self.append(repo_name, path, [(code, None if pd.isna(count) else int(count))
+                                          for code, count in zip(file_df['code'], tokens)])
+        for repo_name in list(self.buffers):
+            self.finish_repo(repo_name)
+        print("Imported", len(samples_df), "functions from", xlsx_path)
@@ -0,0 +1,30 @@
+from functools import lru_cache
+
+from src.utils.language_utils.base import LanguageUtil
+from src.utils.language_utils.go import GoUtils
+from src.utils.language_utils.java import JavaUtils
+from src.utils.language_utils.javascript import JavascriptUtils
+from src.utils.language_utils.php import PhpUtils
+from src.utils.language_utils.python import PythonUtils
+from src.utils.language_utils.ruby import RubyUtils
+
+LANGUAGE_UTILS = {
+    "go": GoUtils,
+    "java": JavaUtils,
+    "javascript": JavascriptUtils,
+    "php": PhpUtils,
+    "python": PythonUtils,
+    "ruby": RubyUtils,
+}
+
+
+def get_language_util(language: str) -> LanguageUtil:
+    if language not in LANGUAGE_UTILS:
+        raise NotImplementedError("Language not implemented")
+    return LANGUAGE_UTILS[language]()
+
+
+@lru_cache(maxsize=8192)
+def remove_comments_cached(code: str, language: str) -> str:
+    """Remove comments from a single function, stripping each distinct function only once"""
+    return get_language_util(language).remove_comments(code)
@@ -1,11 +1,116 @@
+import io
 from abc import ABC, abstractmethod
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+import numpy as np
+
+from src.utils.language_utils.comments import CommentSyntax, remove_comments
+from src.utils.tokens import MAX_FUNCTION_TOKENS, cap_tokens
+
+# source text, or an iterator over its lines including line breaks such as an open file
+Source = Union[str, Iterable[str]]
+# function code and its token count, None if the count was not needed to apply the cap
+FunctionRecord = Tuple[str, Optional[int]]
+# functions shorter than this many lines, counted from their first line, are not used
+MIN_FUNCTION_LINES = 3
+
+
+def source_lines(source: Source) -> Iterable[str]:
+    if isinstance(source, str):
+        # split at "\n" only, like iterating over a file opened in text mode
+        return io.StringIO(source)
+    return source
+
+
+def match_brackets(masked: str) -> Tuple[Dict[int, int], Dict[int, int]]:
+    """Match the braces and parentheses of code without literals and comments
+
+    Within one nesting level, opening and closing brackets alternate, so after
+    a stable sort of the brackets by level every opening bracket is directly
+    followed by its closing one. Levels come from a cumulative sum over the
+    characters, so the matching runs in numpy instead of a Python loop over
+    every bracket.
+
+    Args:
+        masked (str): Code as returned by mask_literals
+
+    Returns:
+        Tuple[Dict[int, int], Dict[int, int]]: Offset of the closing brace by the offset of its opening brace,
+            and offset of the opening parenthesis by the offset of its closing parenthesis. Unmatched
+            brackets are left out.
+    """
+    characters = np.frombuffer(masked.encode('utf-32-le'), dtype=np.uint32)
+    pairs = []
+    for opening, closing in (('{', '}'), ('(', ')')):
+        is_opening = characters == ord(opening)
+        is_closing = characters == ord(closing)
+        positions = np.flatnonzero(is_opening | is_closing)
+        step = np.where(is_opening[positions], 1, -1)
+        # an opening bracket is on the level after it, a closing one on the level before it
+        levels = np.cumsum(step) - (step == 1)
+        order = np.argsort(levels, kind='stable')
+        first, second = order[:-1], order[1:]
+        matched = (step[first] == 1) & (step[second] == -1) & (levels[first] == levels[second])
+        pairs.append((positions[first[matched]].tolist(), positions[second[matched]].tolist()))
+    (brace_openings, brace_closings), (parenthesis_openings, parenthesis_closings) = pairs
+    return dict(zip(brace_openings, brace_closings)), dict(zip(parenthesis_closings, parenthesis_openings))
+
+
+def token_end_before(text: str, position: int) -> int:
+    """Offset after the last non-whitespace character before position"""
+    while position > 0 and text[position - 1] in ' \t\r\n\f':
+        position -= 1
+    return position
+
+
+def name_before(text: str, end: int) -> int:
+    """Start of the identifier ending at end, end if there is none"""
+    start = end
+    while start > 0 and (text[start - 1].isalnum() or text[start - 1] in '_$'):
+        start -= 1
+    return start
 
 
 class LanguageUtil(ABC):
-    @abstractmethod
+    comment_syntax: CommentSyntax
+
     def remove_comments(self, file_content:str)-> str:
-        pass
+        return remove_comments(file_content, self.comment_syntax)
 
-    @abstractmethod
     def extract_functions_from_file(self, preprocessed_path: str)-> list[str]:
+        with open(preprocessed_path, 'r') as preprocessed_file:
+            return self.extract_functions_from_source(preprocessed_file)
+
+    def extract_functions_from_source(self, source: Source)-> list[str]:
+        """Extract the functions of comment-free source code
+
+        Args:
+            source (Source): Source text or its lines
+
+        Returns:
+            list[str]: Code of every extracted function
+        """
+        return [code for code, _ in self.extract_function_records(source)]
+
+    def extract_function_records(self, source: Source)-> list[FunctionRecord]:
+        """Extract the functions of comment-free source code with fewer than MAX_FUNCTION_TOKENS tokens
+
+        Args:
+            source (Source): Source text or its lines
+
+        Returns:
+            list[FunctionRecord]: Code and token count of every extracted function
+        """
+        return cap_tokens(self.find_functions(source), MAX_FUNCTION_TOKENS)
+
+    @abstractmethod
+    def find_functions(self, source: Source)-> list[str]:
+        """Find the function candidates of comment-free source code, before the token cap
+
+        Args:
+            source (Source): Source text or its lines
+
+        Returns:
+            list[str]: Code of every candidate function
+        """
         pass
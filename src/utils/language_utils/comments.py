@@ -0,0 +1,471 @@
+import re
+from typing import Iterator, Optional, Tuple
+
+# keywords after which a "/" starts a regular expression literal instead of a division
+REGEX_PREFIX_KEYWORDS = {'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete', 'void', 'throw',
+                         'yield', 'await', 'instanceof'}
+PYTHON_STRING_PREFIXES = set('rRbBuUfF')
+NOT_NEWLINE_PATTERN = re.compile(r'[^\n]')
+
+
+class CommentSyntax:
+    """Lexical rules a language needs for comment removal.
+
+    Args:
+        line_comments (tuple[str]): Markers starting a comment up to the end of the line
+        block_comments (tuple[tuple[str, str]]): (open, close) pairs of block comments
+        strings (tuple[str]): Quote characters of strings with backslash escapes
+        multiline_strings (bool): Whether those strings may span lines
+        raw_strings (tuple[str]): Quote characters of strings without escapes, e.g. Go's backtick
+        triple_quotes (tuple[str]): Triple quote strings, e.g. Python's and Java's text blocks
+        docstrings (bool): Remove triple quote strings that stand alone as statements (Python docstrings)
+        template_literals (bool): Backtick strings with ${...} interpolation (JavaScript)
+        regex_literals (bool): Recognize /.../ regular expression literals (JavaScript)
+        line_start_block_comments (tuple[tuple[str, str]]): Block comments only valid at the start of a line (Ruby's =begin/=end)
+        hash_attributes (bool): "#[" starts an attribute, not a comment (PHP 8)
+    """
+
+    def __init__(self, line_comments=(), block_comments=(), strings=("'", '"'), multiline_strings=False,
+                 raw_strings=(), triple_quotes=(), docstrings=False, template_literals=False,
+                 regex_literals=False, line_start_block_comments=(), hash_attributes=False):
+        self.line_comments = line_comments
+        self.block_comments = block_comments
+        self.strings = strings
+        self.multiline_strings = multiline_strings
+        self.raw_strings = raw_strings
+        self.triple_quotes = triple_quotes
+        self.docstrings = docstrings
+        self.template_literals = template_literals
+        self.regex_literals = regex_literals
+        self.line_start_block_comments = line_start_block_comments
+        self.hash_attributes = hash_attributes
+
+        special = set()
+        special.update(marker[0] for marker in line_comments)
+        special.update(open_marker[0] for open_marker, _ in block_comments)
+        special.update(strings)
+        special.update(raw_strings)
+        special.update(quote[0] for quote in triple_quotes)
+        if template_literals:
+            special.add('`')
+        if regex_literals:
+            special.add('/')
+        # jumps straight to the next character that can change the lexer state
+        self.special_pattern = re.compile('[' + re.escape(''.join(sorted(special))) + ']')
+        # inside a template literal interpolation, braces have to be counted as well
+        self.interpolation_pattern = re.compile('[' + re.escape(''.join(sorted(special | set('{}')))) + ']')
+        # lexer rules by the first character they start with
+        self.line_comments_by_char = _by_first_char(line_comments)
+        self.block_comments_by_char = _by_first_char(block_comments)
+        self.triple_quotes_by_char = _by_first_char(triple_quotes)
+        self.string_end_patterns = {quote: re.compile(r'[\\\n' + re.escape(quote) + ']') for quote in strings}
+
+
+def _by_first_char(markers) -> dict:
+    by_char = {}
+    for marker in markers:
+        by_char.setdefault(marker[0][0], []).append(marker)
+    return by_char
+
+
+PYTHON = CommentSyntax(line_comments=('#',), triple_quotes=('"""', "'''"), docstrings=True)
+JAVASCRIPT = CommentSyntax(line_comments=('//',), block_comments=(('/*', '*/'),), template_literals=True,
+                           regex_literals=True)
+JAVA = CommentSyntax(line_comments=('//',), block_comments=(('/*', '*/'),), triple_quotes=('"""',))
+GO = CommentSyntax(line_comments=('//',), block_comments=(('/*', '*/'),), raw_strings=('`',))
+PHP = CommentSyntax(line_comments=('//', '#'), block_comments=(('/*', '*/'),), multiline_strings=True,
+                    hash_attributes=True)
+RUBY = CommentSyntax(line_comments=('#',), multiline_strings=True, line_start_block_comments=(('=begin', '=end'),))
+
+
+def _find_line_start(source: str, marker: str, start: int) -> int:
+    """Position of the first `marker` at or after start that begins a line, -1 if there is none"""
+    position = source.find(marker, start)
+    while position > 0 and source[position - 1] != '\n':
+        position = source.find(marker, position + 1)
+    return position
+
+
+def _find_unescaped(source: str, quote: str, start: int) -> int:
+    """Position after the first `quote` at or after start that is not escaped by a backslash"""
+    position = start
+    while True:
+        position = source.find(quote, position)
+        if position == -1:
+            return len(source)
+        backslashes = 0
+        while source[position - 1 - backslashes] == '\\':
+            backslashes += 1
+        if backslashes % 2 == 0:
+            return position + len(quote)
+        position += 1
+
+
+def _string_end(source: str, start: int, syntax: CommentSyntax, quote: str) -> int:
+    """Position after the string whose opening quote is at start"""
+    pattern = syntax.string_end_patterns[quote]
+    position = start + 1
+    while True:
+        match = pattern.search(source, position)
+        if match is None:
+            return len(source)
+        char = match.group()
+        if char == '\\':
+            position = match.start() + 2
+        elif char == quote:
+            return match.start() + 1
+        elif syntax.multiline_strings:
+            position = match.start() + 1
+        else:
+            # unterminated string, resynchronize at the end of the line
+            return match.start()
+
+
+def _template_end(source: str, position: int) -> tuple[int, bool]:
+    """Scan a template literal from position
+
+    Returns:
+        tuple[int, bool]: Position after the closing backtick or the "${", and whether an interpolation starts
+    """
+    length = len(source)
+    while position < length:
+        char = source[position]
+        if char == '\\':
+            position += 2
+        elif char == '`':
+            return position + 1, False
+        elif char == '$' and source.startswith('${', position):
+            return position + 2, True
+        else:
+            position += 1
+    return length, False
+
+
+def _template(source: str, start: int, template_stack: list[int]) -> Tuple[Tuple[str, int, int], int]:
+    """Template literal part from start, up to its closing backtick or next interpolation
+
+    An interpolation is pushed onto template_stack with one open "{".
+
+    Returns:
+        Tuple[Tuple[str, int, int], int]: Span of the text and the position to continue scanning from
+    """
+    end, interpolation = _template_end(source, start)
+    if interpolation:
+        template_stack.append(1)
+        return ('template', start, end - 2), end
+    return ('template', start, max(end - 1, start)), end
+
+
+def _is_regex_start(source: str, position: int) -> bool:
+    """Whether the "/" at position starts a regular expression literal"""
+    before = position - 1
+    while before >= 0 and source[before] in ' \t\r\n':
+        before -= 1
+    if before < 0:
+        return True
+    char = source[before]
+    if char in ')]}' or char == '"' or char == "'" or char == '`':
+        return False
+    if char.isalnum() or char in '_$':
+        word_end = before + 1
+        while before >= 0 and (source[before].isalnum() or source[before] in '_$'):
+            before -= 1
+        return source[before + 1:word_end] in REGEX_PREFIX_KEYWORDS
+    return True
+
+
+def _regex_end(source: str, start: int) -> Optional[int]:
+    """Position after the regular expression literal at start, None if it is not closed on its line"""
+    position = start + 1
+    in_class = False
+    length = len(source)
+    while position < length:
+        char = source[position]
+        if char == '\\':
+            position += 2
+            continue
+        if char == '\n':
+            return None
+        if char == '[':
+            in_class = True
+        elif char == ']':
+            in_class = False
+        elif char == '/' and not in_class:
+            return position + 1
+        position += 1
+    return None
+
+
+def scan_literals(source: str, syntax: CommentSyntax) -> Iterator[Tuple[str, int, int]]:
+    """Find the comments and literals of source code in a single pass.
+
+    This is the one lexer of the comment rules; remove_comments and
+    mask_literals only decide what to do with the spans it finds. Code inside
+    template literal interpolations is scanned like any other code.
+
+    Args:
+        source (str): Source code
+        syntax (CommentSyntax): Lexical rules of the language
+
+    Yields:
+        Tuple[str, int, int]: (kind, start, end) in source order. Kinds are 'comment', 'triple_quote',
+            'string', 'raw_string' and 'regex', spanning the whole comment or literal, and 'template',
+            spanning the text of a template literal part between its backtick or "}" and its closing
+            backtick or "${"
+    """
+    length = len(source)
+    position = 0
+    # open "{" count per template literal interpolation we are inside of
+    template_stack: list[int] = []
+
+    # line start block comments are found with str.find apart from the special characters, since e.g. Ruby's
+    # "=" would stop the lexer at every assignment. Next (start, pair) of them, start -1 if not searched yet
+    next_line_start_block = (-1, None)
+    while position < length:
+        pattern = syntax.interpolation_pattern if template_stack else syntax.special_pattern
+        match = pattern.search(source, position)
+        if syntax.line_start_block_comments:
+            if next_line_start_block[0] < position:
+                next_line_start_block = (length, None)
+                for pair in syntax.line_start_block_comments:
+                    start = _find_line_start(source, pair[0], position)
+                    if start != -1 and start < next_line_start_block[0]:
+                        next_line_start_block = (start, pair)
+            start, pair = next_line_start_block
+            if start < (length if match is None else match.start()):
+                end = source.find(pair[1], start + len(pair[0]))
+                end = length if end == -1 else end + len(pair[1])
+                yield 'comment', start, end
+                position = end
+                continue
+        if match is None:
+            break
+        position = match.start()
+        char = match.group()
+
+        if template_stack and char in '{}':
+            if char == '{':
+                template_stack[-1] += 1
+                position += 1
+            elif template_stack[-1] > 1:
+                template_stack[-1] -= 1
+                position += 1
+            else:
+                template_stack.pop()
+                span, position = _template(source, position + 1, template_stack)
+                yield span
+            continue
+
+        line_comment = None
+        for marker in syntax.line_comments_by_char.get(char, ()):
+            if source.startswith(marker, position):
+                line_comment = marker
+        if line_comment is not None and not (syntax.hash_attributes and source.startswith('#[', position)):
+            end = source.find('\n', position)
+            end = length if end == -1 else end
+            yield 'comment', position, end
+            position = end
+            continue
+
+        block_comment = None
+        for pair in syntax.block_comments_by_char.get(char, ()):
+            if source.startswith(pair[0], position):
+                block_comment = pair
+        if block_comment is not None:
+            open_marker, close_marker = block_comment
+            end = source.find(close_marker, position + len(open_marker))
+            end = length if end == -1 else end + len(close_marker)
+            yield 'comment', position, end
+            position = end
+            continue
+
+        triple_quote = None
+        for quote in syntax.triple_quotes_by_char.get(char, ()):
+            if source.startswith(quote, position):
+                triple_quote = quote
+        if triple_quote is not None:
+            end = _find_unescaped(source, triple_quote, position + 3)
+            yield 'triple_quote', position, end
+            position = end
+            continue
+
+        if char in syntax.strings:
+            end = _string_end(source, position, syntax, char)
+            yield 'string', position, end
+            position = end
+            continue
+
+        if char in syntax.raw_strings:
+            end = source.find(char, position + 1)
+            end = length if end == -1 else end + 1
+            yield 'raw_string', position, end
+            position = end
+            continue
+
+        if syntax.template_literals and char == '`':
+            span, position = _template(source, position + 1, template_stack)
+            yield span
+            continue
+
+        if syntax.regex_literals and char == '/' and _is_regex_start(source, position):
+            end = _regex_end(source, position)
+            if end is None:
+                position += 1
+            else:
+                yield 'regex', position, end
+                position = end
+            continue
+
+        position += 1
+
+
+def remove_comments(source: str, syntax: CommentSyntax) -> str:
+    """Remove all comments from source code in a single pass.
+
+    String, character, template and regular expression literals are skipped, so
+    comment markers inside them are kept. Lines that only contained comments are
+    dropped, code in front of a line comment keeps its line.
+
+    With docstrings, a triple quote string that is a whole expression statement
+    is dropped as well, or becomes pass if it is the only statement of its body.
+    A triple quote string starting a line in any other place, e.g. an argument,
+    becomes an empty literal, so the result still parses.
+
+    Args:
+        source (str): Source code
+        syntax (CommentSyntax): Lexical rules of the language
+
+    Returns:
+        str: Source code without comments
+    """
+    output: list[str] = []
+    length = len(source)
+    copy_from = 0
+    # whether the current output line holds nothing but whitespace so far
+    line_blank = True
+
+    def skip(start: int, end: int):
+        """Drop the comment source[start:end] and its line, if nothing else is on it"""
+        nonlocal copy_from, line_blank
+        pending = source[copy_from:start]
+        line_start = pending.rfind('\n') + 1
+        if line_start > 0:
+            line_blank = not pending[line_start:].strip()
+        else:
+            line_blank = line_blank and not pending.strip()
+        line_end = source.find('\n', end)
+        line_end = length if line_end == -1 else line_end
+        if line_blank and not source[end:line_end].strip():
+            # comment-only line, drop it including its line break
+            if line_start > 0:
+                output.append(pending[:line_start])
+            else:
+                while output and not output[-1].strip(' \t'):
+                    output.pop()
+                if output:
+                    output[-1] = output[-1].rstrip(' \t')
+            copy_from = min(line_end + 1, length)
+            return
+        pending = pending.rstrip(' \t')
+        if pending:
+            output.append(pending)
+        elif output:
+            output[-1] = output[-1].rstrip(' \t')
+        copy_from = end
+
+    def replace(start: int, end: int, text: str):
+        nonlocal copy_from, line_blank
+        output.append(source[copy_from:start])
+        output.append(text)
+        copy_from = end
+        line_blank = False
+
+    def last_code_char(end: int) -> str:
+        """Last non-whitespace character of the output up to source position end"""
+        pending = source[copy_from:end].rstrip()
+        if pending:
+            return pending[-1]
+        for piece in reversed(output):
+            piece = piece.rstrip()
+            if piece:
+                return piece[-1]
+        return ''
+
+    def ends_block(end: int, indent: int) -> bool:
+        """Whether the next line of code after position end is indented less than indent, or there is none"""
+        line_start = source.find('\n', end)
+        while line_start != -1:
+            line_end = source.find('\n', line_start + 1)
+            line = source[line_start + 1:length if line_end == -1 else line_end]
+            code = line.lstrip(' \t')
+            if code.strip() and code[0] != '#':
+                return len(line) - len(code) < indent
+            line_start = line_end
+        return True
+
+    # bracket depth of the code before the current span, only Python needs it for docstrings
+    depth = 0
+    code_from = 0
+    for kind, start, end in scan_literals(source, syntax):
+        if syntax.docstrings:
+            depth += (source.count('(', code_from, start) + source.count('[', code_from, start) + source.count('{', code_from, start)
+                      - source.count(')', code_from, start) - source.count(']', code_from, start) - source.count('}', code_from, start))
+            code_from = end
+        if start < copy_from:
+            # on a comment-only line that was already dropped
+            continue
+        if kind == 'comment':
+            skip(start, end)
+        elif kind == 'triple_quote' and syntax.docstrings:
+            # a string prefix such as r or b belongs to the docstring
+            prefix_start = start
+            while prefix_start > 0 and start - prefix_start < 2 and source[prefix_start - 1] in PYTHON_STRING_PREFIXES:
+                prefix_start -= 1
+            line_start = source.rfind('\n', 0, prefix_start) + 1
+            if not source[max(line_start, copy_from):prefix_start].strip() and (copy_from <= line_start or line_blank):
+                line_end = source.find('\n', end)
+                rest = source[end:length if line_end == -1 else line_end].strip()
+                # only a string that is a whole expression statement is a docstring and can go
+                is_statement = (depth == 0 and (not rest or rest[0] == '#')
+                                and not source[:line_start].rstrip('\r\n').endswith('\\'))
+                if not is_statement:
+                    replace(prefix_start, end, source[prefix_start:start + 3] + source[start:start + 3])
+                elif last_code_char(prefix_start) == ':' and ends_block(end, prefix_start - line_start):
+                    # the only statement of a body, which must not become empty
+                    replace(prefix_start, end, 'pass')
+                else:
+                    skip(prefix_start, end)
+
+    output.append(source[copy_from:])
+    return ''.join(output)
+
+
+def mask_literals(source: str, syntax: CommentSyntax) -> str:
+    """Blank out comments and the contents of literals in a single pass.
+
+    The result has the same length and line breaks as source, so offsets found
+    in it are offsets into source. Literals keep their opening delimiter, and
+    template literals keep their backticks and the braces of their
+    interpolations, whose code is scanned like any other code. Brackets,
+    keywords and operators left in the result are the ones of the code.
+
+    Args:
+        source (str): Source code
+        syntax (CommentSyntax): Lexical rules of the language
+
+    Returns:
+        str: Source code with blanked comments and literals
+    """
+    output: list[str] = []
+    copy_from = 0
+    for kind, start, end in scan_literals(source, syntax):
+        if kind != 'comment' and kind != 'template':
+            start += 1
+        output.append(source[copy_from:start])
+        if source.find('\n', start, end) == -1:
+            output.append(' ' * (end - start))
+        else:
+            output.append(NOT_NEWLINE_PATTERN.sub(' ', source[start:end]))
+        copy_from = end
+    output.append(source[copy_from:])
+    return ''.join(output)
@@ -0,0 +1,9 @@
+from src.utils.language_utils.base import LanguageUtil, Source
+from src.utils.language_utils.comments import GO
+
+
+class GoUtils(LanguageUtil):
+    comment_syntax = GO
+
+    def find_functions(self, source: Source) -> list[str]:
+        return []
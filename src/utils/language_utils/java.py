@@ -1,14 +1,87 @@
 import re
 
-import tiktoken
+from src.utils.language_utils.base import MIN_FUNCTION_LINES, LanguageUtil, Source, match_brackets, name_before, token_end_before
+from src.utils.language_utils.comments import JAVA, mask_literals
 
-from src.utils.language_utils.base import LanguageUtil
+# a block after a parameter list, optionally with a throws clause: the candidates for method bodies
+BODY_PATTERN = re.compile(r'\)\s*(?:throws\b[^{};()=]*)?\{')
+# "keyword (...) {" starts a statement, not a method
+CONTROL_KEYWORDS = {'if', 'for', 'while', 'switch', 'catch', 'synchronized', 'try'}
+# "new Type(...) {" is an anonymous class and "record Name(...) {" a record, their methods are found on their own
+CLASS_KEYWORDS = {'new', 'record'}
+# arguments of annotations, which may contain "=" and one level of nested parentheses
+ANNOTATION_ARGUMENTS_PATTERN = re.compile(r'\((?:[^()]|\([^()]*\))*\)')
+# a parameter ends with its type and name, e.g. "int x", "List<T> items" or "String... rest"
+PARAMETER_PATTERN = re.compile(r'[\w$>\].]\s+[\w$]+\s*$')
 
-enc = tiktoken.encoding_for_model("gpt-3.5-turbo")
 
 class JavaUtils(LanguageUtil):
-    def remove_comments(self, file_content:str)-> str:
-        return ""
-    
-    def extract_functions_from_file(self, preprocessed_path: str) -> list[str]:
-        return []
\ No newline at end of file
+    comment_syntax = JAVA
+
+    def find_functions(self, source: Source) -> list[str]:
+        """Slice every method and constructor, with its annotations and modifiers, from the source"""
+        text = source if isinstance(source, str) else ''.join(source)
+        functions = []
+        for start, end in self.function_spans(text):
+            if text.count('\n', start, end) + 1 >= MIN_FUNCTION_LINES:
+                functions.append(text[start:end])
+        return functions
+
+    def function_spans(self, text: str) -> list[tuple[int, int]]:
+        """(start, end) offsets of every method and constructor in source order
+
+        The comment lexer blanks out string, char and text block literals first,
+        so every bracket left belongs to the code, and all brackets are matched
+        in one pass. Method bodies are the blocks after a parameter list and an
+        optional throws clause. Blocks of control statements, anonymous classes
+        and records are skipped, while the methods inside them, like the ones of
+        nested classes, get their own spans. A method starts after the previous
+        ";", "{" or "}" outside parentheses, so annotations, modifiers, type
+        parameters and the return type are part of it.
+
+        Args:
+            text (str): Comment-free source
+
+        Returns:
+            list[tuple[int, int]]: Offsets of the first character and after the closing brace
+        """
+        masked = mask_literals(text, self.comment_syntax)
+        braces, parentheses = match_brackets(masked)
+        spans = []
+        for match in BODY_PATTERN.finditer(masked):
+            body_start = match.end() - 1
+            open_parenthesis = parentheses.get(match.start(), -1)
+            if body_start not in braces or open_parenthesis == -1:
+                continue
+            name_end = token_end_before(masked, open_parenthesis)
+            name_start = name_before(masked, name_end)
+            name = masked[name_start:name_end]
+            if not name or name in CONTROL_KEYWORDS or name[0].isdigit():
+                continue
+            keyword_end = token_end_before(masked, name_start)
+            if masked[name_before(masked, keyword_end):keyword_end] in CLASS_KEYWORDS:
+                continue
+            start = self.declaration_start(masked, name_start)
+            header = masked[start:name_start]
+            # an enum constant with a body, or a statement rather than a declaration
+            if header.startswith(',') or '=' in ANNOTATION_ARGUMENTS_PATTERN.sub('', header) or masked[keyword_end - 1:keyword_end] == '.':
+                continue
+            # without modifiers or a return type it is a constructor only if its arguments are parameters
+            parameters = masked[open_parenthesis + 1:match.start()]
+            if not header and parameters.strip() and not PARAMETER_PATTERN.search(parameters.rsplit(',', 1)[-1]):
+                continue
+            spans.append((start, braces[body_start] + 1))
+        return spans
+
+    def declaration_start(self, masked: str, name_start: int) -> int:
+        """First character after the ";", "{" or "}" that precedes a method name outside parentheses"""
+        position = name_start
+        while position > 0:
+            boundary = max(masked.rfind(';', 0, position), masked.rfind('{', 0, position), masked.rfind('}', 0, position))
+            # braces of an annotation argument such as @SuppressWarnings({"a", "b"})
+            if boundary != -1 and masked.count('(', boundary, name_start) < masked.count(')', boundary, name_start):
+                position = boundary
+                continue
+            start = boundary + 1
+            return start + len(masked[start:name_start]) - len(masked[start:name_start].lstrip())
+        return 0
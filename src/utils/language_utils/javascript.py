@@ -1,92 +1,111 @@
 import re
 
-import tiktoken
+from src.utils.language_utils.base import MIN_FUNCTION_LINES, LanguageUtil, Source, match_brackets, name_before, token_end_before
+from src.utils.language_utils.comments import JAVASCRIPT, mask_literals
 
-from src.utils.language_utils.base import LanguageUtil
+STOP_WORDS = ['webpack'] # "use strict"
+# a block after a parameter list or an arrow, the candidates for function bodies
+BODY_PATTERN = re.compile(r'(\)|=>)\s*\{')
+# "keyword (...) {" starts a statement, not a function
+CONTROL_KEYWORDS = {'if', 'for', 'while', 'switch', 'catch', 'with'}
+METHOD_MODIFIERS = {'static', 'async', 'get', 'set'}
+# what may precede a function on its line to be kept with it, e.g. "export const f = "
+DECLARATION_PREFIX_PATTERN = re.compile(r'[ \t]*(?:export\s+(?:default\s+)?)?'
+                                        r'(?:(?:const|let|var)\s+[\w$]+\s*=\s*|(?:[\w$.]+|[\'"]\s*)\s*[:=]\s*)?')
 
-enc = tiktoken.encoding_for_model("gpt-3.5-turbo")
 
 class JavascriptUtils(LanguageUtil):
 
-    def remove_comments(self, file_content:str)-> str:
-        replacement_result = re.sub(pattern="\/\*[\s\S]*?\*\/|([^\\:]|^)\/\/.*$",
-            flags=re.MULTILINE,
-            repl=r'\1',
-            string=file_content)
-        return replacement_result
-    
-    def extract_functions_from_file(self, preprocessed_path: str) -> list[str]:
-        functions: list = []
-        insideFunction: bool = False
-        hasLineWithMoreOpenBrackets: bool = False
-        startLine: int = 0
-        openCount: int = 0
-        closeCount: int = 0
-        current_function:str = ''
+    comment_syntax = JAVASCRIPT
 
-        # string not in quotes --> function(?=([^[`\"']]*[`\"'][^[`\"']]*[`\"'])*[^[`\"']]*$)
-
-        with open(preprocessed_path, 'r') as preprossedFile:
-            for (line_index, line) in enumerate(preprossedFile, start=1):
-                if not insideFunction and self.is_start_of_function(line):
-                    openCount = 0
-                    closeCount = 0
-                    startLine = line_index
-                    current_function = ''
-                    # FOR DEBUGGING: 
-                    #currentFunction = '// FUNCTION BEGIN\n'
-                    hasLineWithMoreOpenBrackets = False
-                    insideFunction = True
-                openCount += line.count('{')
-                closeCount += line.count('}')
-                if(insideFunction):
-                    if(not hasLineWithMoreOpenBrackets):
-                        hasLineWithMoreOpenBrackets = self.is_line_with_more_open_brackets(openCount, closeCount)
-                    current_function += line
-                    if (hasLineWithMoreOpenBrackets and self.is_end_of_function(openCount, closeCount)):
-                        insideFunction = False
-                        
-                        #functions shorter than three lines are not used
-                        stop_words = ['webpack'] # "use strict"
-                        if line_index - startLine >= 3:
-                            if not any(stop_word in current_function for stop_word in stop_words):
-                                if len(enc.encode(current_function)) < 2500:
-                                    functions.append(current_function.strip())
-                        # FOR DEBUGGING: currentFunction += '// FUNCTION END\n'
-                        #documentedCode = documentCodeViaAI(currentFunction)
-                        #documentedCode = currentFunction
+    def find_functions(self, source: Source) -> list[str]:
+        """Slice every function declaration, function expression, block arrow function and method from the source"""
+        text = source if isinstance(source, str) else ''.join(source)
+        functions = []
+        for start, end in self.function_spans(text):
+            if text.count('\n', start, end) + 1 >= MIN_FUNCTION_LINES:
+                function = text[start:end]
+                if not any(stop_word in function for stop_word in STOP_WORDS):
+                    functions.append(function)
         return functions
 
-    def is_start_of_function(self, line: str)-> bool:
-        line = re.sub("`.*`", "``", line)
-        line = re.sub("'.*'", "''", line)
-        line = re.sub("\".*\"", "\"\"", line)
-        if 'function' in line:
-            return True
-        return False
-    def is_end_of_function(self, open_count: int, close_count: int)-> bool:
-        """Is line end of current function
+    def function_spans(self, text: str) -> list[tuple[int, int]]:
+        """(start, end) offsets of every function in source order
+
+        The comment lexer blanks out all literals first, so every bracket left
+        belongs to the code, and all brackets are matched in one pass. Function
+        bodies are the blocks after a parameter list or an arrow; blocks of if,
+        for, while, switch, catch and with are skipped, and a block after
+        "name(...)" without the function keyword is a method. A declaration
+        like "export const f = " in front of a function on its line is kept.
 
         Args:
-            open_count (int): Number of opening brackets "{"
-            close_count (int): Number of closing brackets "}"
+            text (str): Comment-free source
 
         Returns:
-            bool: Whether is end of function
+            list[tuple[int, int]]: Offsets of the first character and after the closing brace
         """
-        if (open_count == 0 or close_count == 0):
-            return False
-        return open_count == close_count
-    def is_line_with_more_open_brackets(self, open_count: int, close_count: int)-> bool:
-        """Whether a link has more open brackets than closed
+        masked = mask_literals(text, self.comment_syntax)
+        braces, parentheses = match_brackets(masked)
+        spans = []
+        for match in BODY_PATTERN.finditer(masked):
+            body_start = match.end() - 1
+            if body_start not in braces:
+                continue
+            if match.group(1) == '=>':
+                start = self.arrow_start(masked, match.start(), parentheses)
+            else:
+                start = self.parameters_owner_start(masked, parentheses.get(match.start(), -1))
+            if start == -1:
+                continue
+            line_start = masked.rfind('\n', 0, start) + 1
+            if DECLARATION_PREFIX_PATTERN.fullmatch(masked, line_start, start):
+                prefix = masked[line_start:start]
+                start = line_start + len(prefix) - len(prefix.lstrip())
+            spans.append((start, braces[body_start] + 1))
+        spans.sort()
+        return spans
 
-        Args:
-            open_count (int): Number of opening brackets "{"
-            close_count (int): Number of closing brackets "}"
+    def arrow_start(self, masked: str, arrow: int, parentheses: dict) -> int:
+        """Start of the parameters of the arrow function whose "=>" is at arrow, -1 if there are none"""
+        end = token_end_before(masked, arrow)
+        if masked[end - 1:end] == ')':
+            start = parentheses.get(end - 1, -1)
+        else:
+            start = name_before(masked, end)
+        if start == -1 or start == end:
+            return -1
+        keyword_end = token_end_before(masked, start)
+        keyword_start = name_before(masked, keyword_end)
+        return keyword_start if masked[keyword_start:keyword_end] == 'async' else start
 
-        Returns:
-            bool: Whether open count is greater than close count
-        """
-        if (open_count == 0 and close_count == 0):
-            return False
-        return open_count > close_count
\ No newline at end of file
+    def parameters_owner_start(self, masked: str, open_parenthesis: int) -> int:
+        """Start of the function or method owning the parameter list at open_parenthesis, -1 for statements"""
+        if open_parenthesis == -1:
+            return -1
+        name_end = token_end_before(masked, open_parenthesis)
+        name_start = name_before(masked, name_end)
+        name = masked[name_start:name_end]
+        if not name or name in CONTROL_KEYWORDS or name[0].isdigit():
+            return -1
+        # a private method
+        start = name_start - 1 if masked[name_start - 1:name_start] == '#' else name_start
+        # "function name(", "function* name(", or the modifiers of a method
+        while name != 'function':
+            end = token_end_before(masked, start)
+            if masked[end - 1:end] == '*':
+                start = end - 1
+                continue
+            word_start = name_before(masked, end)
+            word = masked[word_start:end]
+            if word != 'function' and word not in METHOD_MODIFIERS:
+                break
+            start = word_start
+            if word == 'function':
+                break
+        if masked.startswith('function', start):
+            keyword_end = token_end_before(masked, start)
+            keyword_start = name_before(masked, keyword_end)
+            if masked[keyword_start:keyword_end] == 'async':
+                start = keyword_start
+        return start
@@ -1,74 +1,160 @@
 import re
+from functools import lru_cache
 
-import tiktoken
+from src.utils.language_utils.base import MIN_FUNCTION_LINES, LanguageUtil, Source
+from src.utils.language_utils.comments import PYTHON
 
-from src.utils.language_utils.base import LanguageUtil
+# string literals of comment-free source, escaped line breaks included
+STRING_PATTERN = re.compile(r"""'''[^'\\]*(?:(?:\\.|'(?!''))[^'\\]*)*'''"""
+                            r'''|"""[^"\\]*(?:(?:\\.|"(?!""))[^"\\]*)*"""'''
+                            r"""|'[^'\\\n]*(?:\\.[^'\\\n]*)*'"""
+                            r'''|"[^"\\\n]*(?:\\.[^"\\\n]*)*"''', re.DOTALL)
+NOT_NEWLINE_PATTERN = re.compile(r'[^\n]')
+# starts with a literal, so the regex engine skips ahead to candidates instead of trying every line start
+DEF_PATTERN = re.compile(r'def[ \t]')
+HEADER_PATTERN = re.compile(r'[()\[\]{}:]')
+OPENING_BRACKETS = '([{'
+CLOSING_BRACKETS = ')]}'
+
+
+@lru_cache(maxsize=None)
+def dedent_pattern(indent: int) -> re.Pattern:
+    """Line break before a line that is not blank and indented by at most indent characters"""
+    return re.compile(r'\n[ \t\f]{0,%d}(?=[^ \t\f\r\n])' % indent)
+
+
+def mask_string(match: re.Match) -> str:
+    """Blank out a string literal, keeping its length and line breaks
+
+    A string spanning lines becomes a pair of brackets, so its lines count as
+    continuation lines like the ones inside brackets.
+    """
+    string = match.group()
+    if '\n' in string:
+        return '(' + NOT_NEWLINE_PATTERN.sub(' ', string[1:-1]) + ')'
+    return string[0] + ' ' * (len(string) - 1)
+
+
+def bracket_balance(text: str, start: int, end: int) -> int:
+    return (text.count('(', start, end) + text.count('[', start, end) + text.count('{', start, end)
+            - text.count(')', start, end) - text.count(']', start, end) - text.count('}', start, end))
+
+
+def ends_with_backslash(text: str, line_break: int) -> bool:
+    """Whether the line ending at the line break at offset line_break is continued by a backslash"""
+    last = line_break - 2 if text[line_break - 1:line_break] == '\r' else line_break - 1
+    return last >= 0 and text[last] == '\\'
+
+
+def line_end(text: str, position: int) -> int:
+    """Offset of the line break ending the line at position, or the end of the text"""
+    end = text.find('\n', position)
+    return len(text) if end == -1 else end
 
-enc = tiktoken.encoding_for_model("gpt-3.5-turbo")
 
 class PythonUtils(LanguageUtil):
-    def remove_comments(self, file_content:str)-> str:
-        replacement_result = re.sub(pattern='"""[^"]*"""',
-                                    flags=re.MULTILINE,
-                                    repl='""""""',
-                                    string=file_content)
-        replacement_result = re.sub(pattern='^ *#.*\n?',
-                                    flags=re.MULTILINE,
-                                    repl='',
-                                    string=replacement_result)
-        return replacement_result
-    
-    def extract_functions_from_file(self, preprocessed_path: str) -> list[str]:
-        functions: list = []
-        inside_function: bool = False
-        function_start_white_space_count: int = 0
-        start_line: int = 0
-        current_function:str = ''
-
-        with open(preprocessed_path, 'r') as preprossedFile:
-            for (line_index, line) in enumerate(preprossedFile, start=1):
-                if not inside_function and self.is_start_of_function(line):
-                    start_line = line_index
-                    function_start_white_space_count = self.count_whitespace(line)
-                    current_function = line
-                    inside_function = True
-                elif(inside_function):
-                    current_whitespace_count = self.count_whitespace(line)
-                    if (current_whitespace_count == function_start_white_space_count):
-                        inside_function = False
-                        
-                        #functions shorter than three lines are not used
-                        stop_words = []
-                        if line_index - start_line >= 3:
-                            if not any(stop_word in current_function for stop_word in stop_words):
-                                if len(enc.encode(current_function)) < 2500:
-                                    functions.append(current_function)
-                        
-                        if self.is_start_of_function(line):
-                            start_line = line_index
-                            function_start_white_space_count = self.count_whitespace(line)
-                            current_function = line
-                            inside_function = True
-                    else:
-                        current_function += line
+    comment_syntax = PYTHON
+
+    def find_functions(self, source: Source) -> list[str]:
+        """Slice every top-level and nested function, including its decorators, from the source"""
+        text = source if isinstance(source, str) else ''.join(source)
+        functions = []
+        for start, def_start, end in self.function_spans(text):
+            line_count = text.count('\n', def_start, end) + (not text.endswith('\n', 0, end))
+            if line_count >= MIN_FUNCTION_LINES:
+                functions.append(text[start:end])
         return functions
-    
-    def is_start_of_function(self, line: str)-> bool:
-        line = re.sub("`.*`", "``", line)
-        line = re.sub("'.*'", "''", line)
-        line = re.sub("\".*\"", "\"\"", line)
-        line = re.sub("^\s*", "", line)
-        if line.startswith('def'):
-            return True
-        return False
-    
-    def count_whitespace(self, line: str)-> int:
-        """Count trailing whitespace of line
+
+    def function_spans(self, text: str) -> list[tuple[int, int, int]]:
+        """(start, def start, end) offsets of every function in source order
+
+        String literals are blanked out first, keeping offsets and line breaks, so
+        indentation, brackets and def keywords are only seen in code. A function
+        ends before the next line indented no deeper than its def that is neither
+        inside brackets nor continued by a backslash, or with its header line if
+        the body is on the same line. Every search runs in the regex engine, so
+        the source is never walked line by line in Python.
 
         Args:
-            line (str): Line of file
+            text (str): Comment-free source
 
         Returns:
-            int: Trailing whitespace count
+            list[tuple[int, int, int]]: Offsets of the first decorator or def line, of the def line
+                and after the line break of the last line
         """
-        return len(line) - len(line.lstrip())
\ No newline at end of file
+        masked = STRING_PATTERN.sub(mask_string, text)
+        spans = []
+        for match in DEF_PATTERN.finditer(masked):
+            def_start = masked.rfind('\n', 0, match.start()) + 1
+            prefix = masked[def_start:match.start()]
+            indent = len(prefix) - len(prefix.lstrip(' \t\f'))
+            # only a def keyword starting a line, possibly after async, starts a function
+            if prefix[indent:] and (prefix.split() != ['async'] or prefix[-1] not in ' \t'):
+                continue
+            body_start = self.header_end(masked, match.end())
+            if body_start == -1:
+                end = len(masked)
+            elif masked[body_start:line_end(masked, body_start)].strip():
+                end = self.logical_line_end(masked, body_start)
+            else:
+                end = self.body_end(masked, body_start, indent)
+            # trailing blank lines are not part of the function
+            last = def_start + len(text[def_start:end].rstrip())
+            spans.append((self.decorators_start(masked, def_start), def_start,
+                          min(line_end(masked, last) + 1, len(masked))))
+        return spans
+
+    def header_end(self, masked: str, position: int) -> int:
+        """Offset after the colon ending the header, -1 if there is none"""
+        depth = 0
+        for match in HEADER_PATTERN.finditer(masked, position):
+            character = match.group()
+            if character == ':':
+                if depth == 0:
+                    return match.end()
+            elif character in OPENING_BRACKETS:
+                depth += 1
+            else:
+                depth -= 1
+        return -1
+
+    def logical_line_end(self, masked: str, position: int) -> int:
+        """End of the line at position, extended over backslash and bracket continuations"""
+        end = line_end(masked, position)
+        while end < len(masked) and (ends_with_backslash(masked, end) or bracket_balance(masked, position, end) > 0):
+            end = line_end(masked, end + 1)
+        return end
+
+    def body_end(self, masked: str, body_start: int, indent: int) -> int:
+        """Start of the first line after the body, or the end of the source"""
+        pattern = dedent_pattern(indent)
+        position = body_start
+        while True:
+            match = pattern.search(masked, position)
+            if match is None:
+                return len(masked)
+            line_start = match.start() + 1
+            if not ends_with_backslash(masked, line_start - 1) and bracket_balance(masked, body_start, line_start) <= 0:
+                return line_start
+            position = line_end(masked, line_start)
+
+    def decorators_start(self, masked: str, def_start: int) -> int:
+        """Start of the first decorator line above a def line, decorators may span lines themselves"""
+        start = scan = def_start
+        balance = 0
+        while scan > 0:
+            previous = masked.rfind('\n', 0, scan - 1) + 1
+            line = masked[previous:scan].strip()
+            scan = previous
+            if not line:
+                continue
+            if balance == 0 and line[0] != '@' and line[-1] not in CLOSING_BRACKETS:
+                break
+            balance -= bracket_balance(line, 0, len(line))
+            if balance > 0:
+                # inside the arguments of a decorator spanning lines
+                continue
+            if balance < 0 or line[0] != '@':
+                break
+            start = previous
+        return start
@@ -0,0 +1,9 @@
+from src.utils.language_utils.base import LanguageUtil, Source
+from src.utils.language_utils.comments import RUBY
+
+
+class RubyUtils(LanguageUtil):
+    comment_syntax = RUBY
+
+    def find_functions(self, source: Source) -> list[str]:
+        return []
@@ -0,0 +1,130 @@
+import os
+import sqlite3
+import threading
+from typing import Iterable, Mapping, Set, Tuple
+
+import pandas as pd
+
+
+class MiningState:
+    """Progress of repo mining in an indexed SQLite database.
+
+    Finished repos and finished (repo, file) pairs are primary keys, so every
+    lookup is a single index probe and a repo path never matches another one it
+    is a prefix of. The number of collected functions is kept in a counter that
+    is updated in the same transaction as the files it counts, and so is the
+    index of the git blob SHAs of finished files, which lets byte-identical
+    files of other repos be skipped.
+
+    On first use the state is migrated from finished_repos_<language>.txt and
+    the functions collected so far, see `import_legacy`.
+
+    Args:
+        language (str): Language being mined
+        db_path (str): Database file, mining_state_<language>.sqlite if None
+    """
+
+    def __init__(self, language: str, db_path: str = None):
+        self.language = language
+        self.db_path = db_path or f'mining_state_{language}.sqlite'
+        # a new database still has to be migrated from the txt/xlsx state
+        self.is_new = not os.path.exists(self.db_path)
+        # the pipeline checks repos from its extraction thread and finishes them from the event loop
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS repos (path TEXT PRIMARY KEY)')
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS files (
+            repo TEXT NOT NULL,
+            path TEXT NOT NULL,
+            functions INTEGER NOT NULL,
+            PRIMARY KEY (repo, path))''')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS blobs (sha TEXT PRIMARY KEY, repo TEXT NOT NULL, path TEXT NOT NULL)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        self.connection.execute("INSERT OR IGNORE INTO counters VALUES ('functions', 0)")
+        self.function_count = self.connection.execute("SELECT value FROM counters WHERE name = 'functions'").fetchone()[0]
+
+    def is_repo_finished(self, repo_path: str) -> bool:
+        with self.lock:
+            return self.connection.execute('SELECT 1 FROM repos WHERE path = ?', (repo_path,)).fetchone() is not None
+
+    def set_repo_finished(self, repo_path: str):
+        with self.lock:
+            self.connection.execute('INSERT OR IGNORE INTO repos VALUES (?)', (repo_path,))
+
+    def is_file_finished(self, repo_name: str, path: str) -> bool:
+        with self.lock:
+            return self.connection.execute('SELECT 1 FROM files WHERE repo = ? AND path = ?', (repo_name, path)).fetchone() is not None
+
+    def set_files_finished(self, repo_name: str, files: Iterable[Tuple[str, int]], blobs: Mapping[str, str] = None):
+        """Mark files finished and add their functions to the count in one transaction
+
+        Args:
+            repo_name (str): Repo of the files
+            files (Iterable[Tuple[str, int]]): (file path, number of extracted functions) pairs
+            blobs (Mapping[str, str]): Git blob SHA per file path, files without one are not indexed
+        """
+        blobs = blobs or {}
+        with self.lock:
+            self.connection.execute('BEGIN')
+            added = 0
+            for path, functions in files:
+                cursor = self.connection.execute('INSERT OR IGNORE INTO files VALUES (?, ?, ?)', (repo_name, path, int(functions)))
+                added += int(functions) if cursor.rowcount > 0 else 0
+                if path in blobs:
+                    self.connection.execute('INSERT OR IGNORE INTO blobs VALUES (?, ?, ?)', (blobs[path], repo_name, path))
+            self.connection.execute("UPDATE counters SET value = value + ? WHERE name = 'functions'", (added,))
+            self.connection.execute('COMMIT')
+            self.function_count += added
+
+    def add_blobs(self, repo_name: str, blobs: Mapping[str, str]):
+        """Index the git blob SHAs of extracted files without marking the files finished, for the pipeline
+
+        Args:
+            repo_name (str): Repo of the files
+            blobs (Mapping[str, str]): Git blob SHA per file path
+        """
+        with self.lock:
+            self.connection.executemany('INSERT OR IGNORE INTO blobs VALUES (?, ?, ?)',
+                                        [(sha, repo_name, path) for path, sha in blobs.items()])
+
+    def seen_blobs(self, shas: Iterable[str], exclude_repo: str = None) -> Set[str]:
+        """The git blob SHAs among shas whose file was already extracted
+
+        Args:
+            shas (Iterable[str]): Git blob SHAs to look up
+            exclude_repo (str): Files of this repo don't count, so a resumed repo is no duplicate of itself
+
+        Returns:
+            Set[str]: SHAs found in the index
+        """
+        shas = list(shas)
+        seen = set()
+        with self.lock:
+            # stays below the limit of SQL variables of older SQLite versions
+            for start in range(0, len(shas), 500):
+                chunk = shas[start:start + 500]
+                rows = self.connection.execute(f'SELECT sha FROM blobs WHERE sha IN ({",".join("?" * len(chunk))}) AND repo IS NOT ?',
+                                               chunk + [exclude_repo])
+                seen.update(sha for sha, in rows)
+        return seen
+
+    def import_legacy(self, finished_repos_path: str, samples_df: pd.DataFrame):
+        """Migrate the txt/xlsx progress of earlier runs
+
+        Args:
+            finished_repos_path (str): finished_repos_<language>.txt with one repo path per line
+            samples_df (pd.DataFrame): Functions collected so far with repo and path columns
+        """
+        if os.path.isfile(finished_repos_path):
+            with open(finished_repos_path, 'r') as file:
+                for line in file:
+                    if line.strip():
+                        self.set_repo_finished(line.strip())
+        for repo_name, repo_df in samples_df.groupby('repo', sort=False):
+            self.set_files_finished(repo_name, repo_df.groupby('path', sort=False).size().items())
+        print("Migrated", self.connection.execute('SELECT COUNT(*) FROM repos').fetchone()[0], "finished repos and",
+              self.function_count, "functions")
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,249 @@
+"""Local stand-in for the OpenAI ChatCompletion endpoint, for load tests without quota.
+
+Run from the repository root and point the scripts at it with --api_base:
+    python -m src.utils.mock_server --port 8089 --latency lognormal:0.8,0.5 --error_429 0.02
+    python generate_documentation.py --language python --api_base http://127.0.0.1:8089/v1 --no-cache
+"""
+import argparse
+import asyncio
+import collections
+import hashlib
+import math
+import random
+import re
+import time
+from typing import Callable, Deque, Optional, Tuple
+
+from aiohttp import web
+
+from src.utils.tokens import count_message_tokens, get_encoding
+
+# mirrors PACK_HEADER of generate_documentation, packed prompts get one answer per header
+PACK_HEADER_PATTERN = re.compile(r"^### Function (\d+)$", re.MULTILINE)
+# part of the rating prompts of evaluate_via_ai
+RATING_MARKER = "answering with a number"
+# mirrors BATCH_LABEL of evaluate_via_ai, batched rating prompts get one score per label
+BATCH_LABEL_PATTERN = re.compile(r"^Documentation (\d+):$", re.MULTILINE)
+CANNED_DOCSTRINGS = [
+    "Returns the result of processing the given input.",
+    "Creates a new instance from the given arguments and returns it.",
+    "Checks the given value and raises an error if it is invalid.",
+    "Reads the configuration and updates the internal state accordingly.",
+]
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """Parse a latency distribution such as "lognormal:0.8,0.5"
+
+    Supported: constant:SECONDS, uniform:LOW,HIGH, normal:MEAN,STD,
+    lognormal:MEDIAN,SIGMA and exponential:MEAN.
+
+    Args:
+        spec (str): Distribution name and its parameters in seconds
+
+    Returns:
+        Callable[[random.Random], float]: Draws one latency from a random generator
+    """
+    name, _, parameters = spec.partition(':')
+    values = [float(value) for value in parameters.split(',')] if parameters else []
+    if name == 'constant':
+        return lambda rng: values[0]
+    if name == 'uniform':
+        return lambda rng: rng.uniform(values[0], values[1])
+    if name == 'normal':
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if name == 'lognormal':
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    if name == 'exponential':
+        return lambda rng: rng.expovariate(1 / values[0])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class MockServer:
+    """OpenAI compatible /v1/chat/completions endpoint with canned answers.
+
+    Rating prompts are answered with a number, all other prompts with a docstring,
+    both derived from a hash of the prompt so repeated runs get the same outputs.
+    Each request sleeps for a latency drawn from the distribution plus a cost per
+    prompt and completion token. Errors are injected at the given rates, and
+    requests beyond the rpm/tpm limits of a sliding minute get a 429 with a
+    Retry-After header like the real API.
+
+    Args:
+        latency (str): Latency distribution, see parse_latency
+        seconds_per_prompt_token (float): Added latency per prompt token
+        seconds_per_completion_token (float): Added latency per completion token
+        error_429 (float): Fraction of requests answered with a rate limit error
+        error_5xx (float): Fraction of requests answered with a server error
+        retry_after (float): Retry-After of injected 429s in seconds, -1 to omit the header
+        rpm (int): Requests per minute before 429s, -1 to ignore
+        tpm (int): Tokens per minute before 429s, -1 to ignore
+        rating (int): Fixed rating answer, -1 for a number between 0 and 100 derived from the prompt
+        seed (int): Seed of latency and error injection
+    """
+
+    def __init__(self, latency: str = "lognormal:0.8,0.5", seconds_per_prompt_token: float = 0.0,
+                 seconds_per_completion_token: float = 0.0, error_429: float = 0.0, error_5xx: float = 0.0,
+                 retry_after: float = 1.0, rpm: int = -1, tpm: int = -1, rating: int = -1, seed: int = 0):
+        self.latency = parse_latency(latency)
+        self.seconds_per_prompt_token = seconds_per_prompt_token
+        self.seconds_per_completion_token = seconds_per_completion_token
+        self.error_429 = error_429
+        self.error_5xx = error_5xx
+        self.retry_after = retry_after
+        self.rpm = rpm
+        self.tpm = tpm
+        self.rating = rating
+        self.rng = random.Random(seed)
+        # (time, tokens) of the requests admitted during the last minute
+        self.window: Deque[Tuple[float, int]] = collections.deque()
+        self.window_tokens = 0
+        self.counts = collections.Counter()
+        self.runner: Optional[web.AppRunner] = None
+        self.url = ""
+
+        self.app = web.Application()
+        self.app.router.add_post('/v1/chat/completions', self.chat_completions)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8089) -> str:
+        """Start serving on the running event loop
+
+        Args:
+            host (str): Interface to bind
+            port (int): Port to bind, 0 for a free one
+
+        Returns:
+            str: Base URL to use as api_base
+        """
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        bound_host, bound_port = self.runner.addresses[0][:2]
+        self.url = f"http://{bound_host}:{bound_port}/v1"
+        return self.url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def answer(self, messages: list[dict]) -> str:
+        prompt = messages[-1]['content']
+        digest = int(hashlib.sha256(''.join(message['content'] for message in messages).encode('utf-8')).hexdigest(), 16)
+        if RATING_MARKER in prompt:
+            labels = BATCH_LABEL_PATTERN.findall(messages[0]['content'])
+            if labels:
+                return '\n'.join(f"Documentation {number}: {self.score(digest >> (8 * index))}"
+                                 for index, number in enumerate(labels))
+            return str(self.score(digest))
+        docstrings = [CANNED_DOCSTRINGS[(digest >> (8 * index)) % len(CANNED_DOCSTRINGS)]
+                      for index in range(len(PACK_HEADER_PATTERN.findall(prompt)))]
+        if docstrings:
+            return '\n'.join(f"### Function {number}\n{docstring}" for number, docstring in enumerate(docstrings, start=1))
+        return CANNED_DOCSTRINGS[digest % len(CANNED_DOCSTRINGS)]
+
+    def score(self, digest: int) -> int:
+        return self.rating if self.rating > -1 else digest % 101
+
+    def over_limit(self, tokens: int) -> Optional[float]:
+        """Admit a request into the sliding minute, or return seconds until it would fit"""
+        now = time.monotonic()
+        while self.window and self.window[0][0] <= now - 60:
+            self.window_tokens -= self.window.popleft()[1]
+        over_rpm = self.rpm > -1 and len(self.window) + 1 > self.rpm
+        over_tpm = self.tpm > -1 and self.window_tokens + tokens > self.tpm
+        if over_rpm or over_tpm:
+            oldest = self.window[0][0] if self.window else now
+            return max(1.0, oldest + 60 - now)
+        self.window.append((now, tokens))
+        self.window_tokens += tokens
+        return None
+
+    def error(self, status: int, message: str, error_type: str, retry_after: Optional[float] = None) -> web.Response:
+        headers = {'Retry-After': f"{retry_after:g}"} if retry_after is not None and retry_after > -1 else None
+        body = {'error': {'message': message, 'type': error_type, 'param': None, 'code': None}}
+        return web.json_response(body, status=status, headers=headers)
+
+    async def chat_completions(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self.counts['requests'] += 1
+        model = body.get('model', 'gpt-3.5-turbo')
+        messages = body['messages']
+        content = self.answer(messages)
+        enc = get_encoding()
+        prompt_tokens = count_message_tokens(messages)
+        completion_tokens = len(enc.encode(content))
+
+        limited = self.over_limit(prompt_tokens + completion_tokens)
+        if limited is not None:
+            self.counts['rate_limited'] += 1
+            return self.error(429, "Rate limit reached for requests", 'requests', limited)
+        draw = self.rng.random()
+        if draw < self.error_429:
+            self.counts['injected_429'] += 1
+            return self.error(429, "Rate limit reached for requests", 'requests', self.retry_after)
+        if draw < self.error_429 + self.error_5xx:
+            self.counts['injected_5xx'] += 1
+            status = self.rng.choice([500, 502, 503])
+            return self.error(status, "The server had an error while processing your request", 'server_error')
+
+        await asyncio.sleep(self.latency(self.rng) + prompt_tokens * self.seconds_per_prompt_token
+                            + completion_tokens * self.seconds_per_completion_token)
+        self.counts['completed'] += 1
+        return web.json_response({
+            'id': f"chatcmpl-mock-{self.counts['requests']}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens},
+        })
+
+    def report(self) -> str:
+        return (f"Mock server: {self.counts['requests']} requests, {self.counts['completed']} completed, "
+                f"{self.counts['injected_429']} injected 429s, {self.counts['injected_5xx']} injected 5xx, "
+                f"{self.counts['rate_limited']} over rpm/tpm")
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Options of the mock server, shared with the load test"""
+    parser_mock = parser.add_argument_group("mock_server")
+    parser_mock.add_argument("--latency", type=str, default="lognormal:0.8,0.5")
+    parser_mock.add_argument("--seconds_per_prompt_token", type=float, default=0.0)
+    parser_mock.add_argument("--seconds_per_completion_token", type=float, default=0.0)
+    parser_mock.add_argument("--error_429", type=float, default=0.0)
+    parser_mock.add_argument("--error_5xx", type=float, default=0.0)
+    # set to -1 to omit the Retry-After header of injected 429s
+    parser_mock.add_argument("--retry_after", type=float, default=1.0)
+    # set to -1 to ignore
+    parser_mock.add_argument("--server_rpm", type=int, default=-1)
+    parser_mock.add_argument("--server_tpm", type=int, default=-1)
+    parser_mock.add_argument("--rating", type=int, default=-1)
+    parser_mock.add_argument("--seed", type=int, default=0)
+
+
+def from_args(args: argparse.Namespace) -> MockServer:
+    return MockServer(latency=args.latency, seconds_per_prompt_token=args.seconds_per_prompt_token,
+                      seconds_per_completion_token=args.seconds_per_completion_token, error_429=args.error_429,
+                      error_5xx=args.error_5xx, retry_after=args.retry_after, rpm=args.server_rpm,
+                      tpm=args.server_tpm, rating=args.rating, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = from_args(args)
+    print("Serving on", f"http://{args.host}:{args.port}/v1")
+    try:
+        web.run_app(server.app, host=args.host, port=args.port, print=None)
+    finally:
+        print(server.report())
+
+
+if __name__ == "__main__":
+    main()
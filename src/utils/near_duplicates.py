@@ -0,0 +1,165 @@
+import keyword
+import re
+import zlib
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from src.utils.language_utils import remove_comments_cached
+
+# string literals, numbers and words are single tokens, every other non-space character is one
+TOKEN_PATTERN = re.compile(r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|`(?:\\.|[^`\\])*`|\w+|[^\w\s]')
+# words that are kept as they are, all other identifiers are renamed in order of appearance
+KEYWORDS = {
+    'go': {'break', 'case', 'chan', 'const', 'continue', 'default', 'defer', 'else', 'fallthrough', 'for', 'func',
+           'go', 'goto', 'if', 'import', 'interface', 'map', 'package', 'range', 'return', 'select', 'struct',
+           'switch', 'type', 'var', 'nil', 'true', 'false', 'err'},
+    'java': {'abstract', 'assert', 'boolean', 'break', 'byte', 'case', 'catch', 'char', 'class', 'continue',
+             'default', 'do', 'double', 'else', 'enum', 'extends', 'final', 'finally', 'float', 'for', 'if',
+             'implements', 'import', 'instanceof', 'int', 'interface', 'long', 'new', 'private', 'protected',
+             'public', 'return', 'short', 'static', 'super', 'switch', 'synchronized', 'this', 'throw', 'throws',
+             'try', 'void', 'while', 'null', 'true', 'false', 'var', 'String', 'Object'},
+    'javascript': {'async', 'await', 'break', 'case', 'catch', 'class', 'const', 'continue', 'default', 'delete',
+                   'do', 'else', 'export', 'extends', 'finally', 'for', 'function', 'if', 'import', 'in',
+                   'instanceof', 'let', 'new', 'of', 'return', 'static', 'super', 'switch', 'this', 'throw', 'try',
+                   'typeof', 'var', 'void', 'while', 'yield', 'null', 'undefined', 'true', 'false'},
+    'php': {'abstract', 'array', 'as', 'break', 'case', 'catch', 'class', 'const', 'continue', 'default', 'do',
+            'echo', 'else', 'elseif', 'extends', 'final', 'finally', 'for', 'foreach', 'function', 'if',
+            'implements', 'instanceof', 'isset', 'new', 'private', 'protected', 'public', 'return', 'self',
+            'static', 'switch', 'this', 'throw', 'try', 'use', 'while', 'null', 'true', 'false'},
+    'python': set(keyword.kwlist) | {'self', 'cls'},
+    'ruby': {'begin', 'break', 'case', 'class', 'def', 'do', 'else', 'elsif', 'end', 'ensure', 'false', 'for', 'if',
+             'in', 'module', 'next', 'nil', 'raise', 'rescue', 'return', 'self', 'super', 'then', 'true', 'unless',
+             'until', 'when', 'while', 'yield'},
+}
+# hashes are permuted modulo this prime, small enough that a * hash + b fits into 64 bits
+MERSENNE_PRIME = (1 << 31) - 1
+# shingles permuted at once, bounds the (permutations x shingles) matrix
+BATCH_SHINGLES = 1 << 15
+
+
+def normalized_tokens(code: str, language: str) -> List[str]:
+    """Tokens of the comment-free code with identifiers renamed in order of appearance
+
+    Whitespace and comments are dropped, and every word that is not a keyword
+    of the language becomes v0, v1, ... by its first appearance, so copies with
+    renamed variables have the same tokens.
+    """
+    keywords = KEYWORDS.get(language, ())
+    names = {}
+    tokens = []
+    for token in TOKEN_PATTERN.findall(remove_comments_cached(code, language)):
+        if (token[0].isalpha() or token[0] == '_') and token not in keywords:
+            token = names.setdefault(token, 'v' + str(len(names)))
+        tokens.append(token)
+    return tokens
+
+
+def shingle_hashes(tokens: Sequence[str], shingle_size: int) -> np.ndarray:
+    """Distinct CRC32 hashes of all runs of shingle_size tokens, one shingle for shorter token lists"""
+    count = max(len(tokens) - shingle_size + 1, 1 if tokens else 0)
+    shingles = ('\x1f'.join(tokens[start:start + shingle_size]).encode('utf-8') for start in range(count))
+    return np.unique(np.fromiter(map(zlib.crc32, shingles), dtype=np.uint64, count=count))
+
+
+def minhash_signatures(hash_sets: Sequence[np.ndarray], num_perm: int = 128, seed: int = 1) -> np.ndarray:
+    """MinHash signature of every set of shingle hashes
+
+    The shingles of many functions are concatenated and permuted with one
+    (permutations x shingles) array operation, and np.minimum.reduceat takes
+    the minimum per function and permutation.
+
+    Args:
+        hash_sets (Sequence[np.ndarray]): Shingle hashes per function
+        num_perm (int): Number of hash permutations, the length of a signature
+        seed (int): Seed of the permutations
+
+    Returns:
+        np.ndarray: (functions x num_perm) signatures, MERSENNE_PRIME everywhere for empty sets
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, MERSENNE_PRIME, num_perm, dtype=np.uint64)[:, None]
+    b = rng.integers(0, MERSENNE_PRIME, num_perm, dtype=np.uint64)[:, None]
+    signatures = np.full((len(hash_sets), num_perm), MERSENNE_PRIME, dtype=np.uint64)
+    lengths = np.array([len(hashes) for hashes in hash_sets], dtype=np.int64)
+
+    def permute(batch: List[int]):
+        hashes = np.concatenate([hash_sets[index] for index in batch]) % MERSENNE_PRIME
+        offsets = np.concatenate(([0], np.cumsum(lengths[batch])[:-1]))
+        signatures[batch] = np.minimum.reduceat((a * hashes + b) % MERSENNE_PRIME, offsets, axis=1).T
+
+    batch, batch_shingles = [], 0
+    for index in np.flatnonzero(lengths):
+        batch.append(index)
+        batch_shingles += lengths[index]
+        if batch_shingles >= BATCH_SHINGLES:
+            permute(batch)
+            batch, batch_shingles = [], 0
+    if batch:
+        permute(batch)
+    return signatures
+
+
+def band_layout(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """(bands, rows per band) whose LSH threshold (1/bands)^(1/rows) is the highest one not above threshold
+
+    Pairs in no common bucket are never compared, so the layout errs on the
+    side of more candidates; the candidates are verified on their signatures.
+    """
+    layouts = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    below = [layout for layout in layouts if (1 / layout[0]) ** (1 / layout[1]) <= threshold]
+    if not below:
+        # thresholds under 1 / num_perm are below every layout, one row per band gets the most candidates
+        return num_perm, 1
+    return max(below, key=lambda layout: (1 / layout[0]) ** (1 / layout[1]))
+
+
+def near_duplicate_representatives(codes: Sequence[str], language: str, threshold: float = 0.85,
+                                   num_perm: int = 128, shingle_size: int = 5) -> np.ndarray:
+    """Index of the representative of every code's near-duplicate cluster
+
+    Codes are shingled into runs of normalized tokens, see normalized_tokens,
+    and their MinHash signatures are split into LSH bands. Codes sharing a band
+    bucket are candidates; a candidate joins the cluster of its bucket's first
+    code if the signatures of both clusters' representatives agree in at least
+    threshold of their values, the estimated Jaccard similarity. The
+    representative of a cluster is its first code.
+
+    Args:
+        codes (Sequence[str]): Function codes, comments are stripped here
+        language (str): Language of the codes
+        threshold (float): Estimated Jaccard similarity of the shingles from which codes are near duplicates
+        num_perm (int): Length of the MinHash signatures
+        shingle_size (int): Tokens per shingle
+
+    Returns:
+        np.ndarray: Representative index per code, the code's own index for representatives
+    """
+    hash_sets = [shingle_hashes(normalized_tokens(code, language), shingle_size) for code in codes]
+    signatures = minhash_signatures(hash_sets, num_perm)
+    has_shingles = np.array([len(hashes) > 0 for hashes in hash_sets], dtype=bool)
+    parents = np.arange(len(codes))
+
+    def find(index: int) -> int:
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    bands, rows = band_layout(num_perm, threshold)
+    rng = np.random.default_rng(0)
+    multipliers = rng.integers(1, 1 << 63, rows, dtype=np.uint64) | np.uint64(1)
+    for band in range(bands):
+        # a multiply-add hash of the band's rows, colliding keys are caught by the verification
+        keys = (signatures[:, band * rows:(band + 1) * rows] * multipliers).sum(axis=1)
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        leaders = first[inverse.ravel()]
+        candidates = np.flatnonzero((leaders != np.arange(len(codes))) & has_shingles)
+        if not len(candidates):
+            continue
+        similar = (signatures[candidates] == signatures[leaders[candidates]]).mean(axis=1) >= threshold
+        for candidate in candidates[similar]:
+            root, leader_root = find(candidate), find(leaders[candidate])
+            if root != leader_root and (signatures[root] == signatures[leader_root]).mean() >= threshold:
+                parents[max(root, leader_root)] = min(root, leader_root)
+    return np.array([find(index) for index in range(len(codes))], dtype=np.int64)
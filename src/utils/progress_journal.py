@@ -0,0 +1,110 @@
+import json
+import os
+import time
+from typing import Any, Dict, Hashable, Set
+
+import pandas as pd
+
+
+class ProgressJournal:
+    """Append-only JSONL journal of finished rows.
+
+    Every result is written as one record (row id, column, value, model, timestamp)
+    instead of rewriting the whole workbook. Records are fsynced every
+    `fsync_every` writes. On restart the journal is replayed onto the DataFrame,
+    and the final workbook is only written once by `compact`.
+    """
+
+    def __init__(self, journal_path: str, model: str, fsync_every: int = 25):
+        self.journal_path = journal_path
+        self.model = model
+        self.fsync_every = fsync_every
+        self.unsynced = 0
+        self.completed: Dict[str, Set[Hashable]] = {}
+        folder = os.path.dirname(journal_path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.file = None
+
+    def read_values(self) -> Dict[str, Dict[Hashable, Any]]:
+        """Read the latest journaled value per column and row
+
+        Returns:
+            Dict[str, Dict[Hashable, Any]]: Values by column, then by row id
+        """
+        values: Dict[str, Dict[Hashable, Any]] = {}
+        if not os.path.exists(self.journal_path):
+            return values
+        with open(self.journal_path, 'r') as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # a crash can leave a partially written last line behind
+                    continue
+                values.setdefault(record['column'], {})[record['row']] = record['value']
+        for column, column_values in values.items():
+            self.completed.setdefault(column, set()).update(column_values)
+        return values
+
+    def replay(self, df: pd.DataFrame) -> int:
+        """Apply all journaled values to the DataFrame
+
+        Args:
+            df (pd.DataFrame): DataFrame the journal was recorded for
+
+        Returns:
+            int: Number of replayed records
+        """
+        replayed = 0
+        for column, column_values in self.read_values().items():
+            if column not in df.columns:
+                df[column] = None
+            rows = pd.Series(column_values)
+            rows = rows[rows.index.isin(df.index)]
+            df.loc[rows.index, column] = rows
+            replayed += len(rows)
+        return replayed
+
+    def completed_rows(self, column: str) -> list:
+        return list(self.completed.get(column, ()))
+
+    def record(self, row_id: Hashable, column: str, value: Any):
+        if self.file is None:
+            self.file = open(self.journal_path, 'a')
+        if hasattr(row_id, 'item'):
+            row_id = row_id.item()
+        if hasattr(value, 'item'):
+            value = value.item()
+        record = {'row': row_id, 'column': column, 'value': value, 'model': self.model, 'time': time.time()}
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.completed.setdefault(column, set()).add(row_id)
+        self.unsynced += 1
+        if self.unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        if self.file is None or self.unsynced == 0:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def close(self):
+        self.sync()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def compact(self, df: pd.DataFrame, output_path: str):
+        """Materialize the DataFrame once, as parquet or xlsx depending on the suffix
+
+        Args:
+            df (pd.DataFrame): DataFrame with all journaled values applied
+            output_path (str): Target file
+        """
+        self.sync()
+        if output_path.endswith('.parquet'):
+            df.to_parquet(output_path, index=False)
+        else:
+            df.to_excel(output_path, index=False)
@@ -0,0 +1,115 @@
+import asyncio
+import time
+from typing import Optional
+
+# (requests per minute, tokens per minute) allowed per model
+MODEL_LIMITS = {
+    "gpt-3.5-turbo-0613": (3500, 90000),
+    "gpt-4": (200, 40000),
+}
+
+
+class TokenBucket:
+    """Bucket refilled continuously with the part of `per_minute` units per minute that a burst leaves.
+
+    The bucket holds at most `burst_seconds` worth of units, so a full bucket
+    cannot release a whole minute of quota at once. It refills the rest of the
+    quota over the minute, so a full bucket plus one minute of refill, the most
+    any 60 s window can admit, is `per_minute`.
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float = 5.0):
+        self.capacity = per_minute * burst_seconds / 60
+        self.rate = (per_minute - self.capacity) / 60
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def allowed(self, seconds: float) -> float:
+        """Most units the bucket admits within `seconds` when it starts full"""
+        return self.capacity + seconds * self.rate
+
+    def refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available"""
+        self.refill()
+        # a single request larger than the bucket only has to wait for a full bucket
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self.level -= amount
+
+    def give_back(self, amount: float):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    """Admits requests through a requests-per-minute and a tokens-per-minute bucket.
+
+    Requests wait in FIFO order until both buckets can cover them, so large
+    prompts are not starved by small ones. Achieved throughput is tracked to
+    report utilization of the allowed quota.
+    """
+
+    def __init__(self, model: str, rpm: int, tpm: int):
+        self.model = model
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.lock: Optional[asyncio.Lock] = None
+        self.started: Optional[float] = None
+        self.request_count = 0
+        self.token_count = 0
+
+    @classmethod
+    def for_model(cls, model: str, rpm: int = -1, tpm: int = -1) -> 'RateLimiter':
+        """Create a limiter with the model's default limits, overridden where rpm/tpm > -1"""
+        default_rpm, default_tpm = MODEL_LIMITS.get(model, MODEL_LIMITS["gpt-3.5-turbo-0613"])
+        return cls(model, rpm if rpm > -1 else default_rpm, tpm if tpm > -1 else default_tpm)
+
+    async def acquire(self, tokens: int):
+        """Wait until a request costing `tokens` may be sent
+
+        Args:
+            tokens (int): Prompt tokens plus max_tokens of the request
+        """
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            while True:
+                wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            self.requests.take(1)
+            self.tokens.take(tokens)
+        if self.started is None:
+            self.started = time.monotonic()
+        self.request_count += 1
+        self.token_count += tokens
+
+    def settle(self, estimated: int, used: Optional[int]):
+        """Return tokens that were reserved for the completion but not used"""
+        if used is None or used >= estimated:
+            return
+        self.tokens.give_back(estimated - used)
+        self.token_count -= estimated - used
+
+    def report(self) -> str:
+        if self.started is None:
+            return f"{self.model}: no requests sent"
+        # the quota since the first request includes the initial burst, so short runs don't exceed 100%
+        elapsed = time.monotonic() - self.started
+        allowed_requests = self.requests.allowed(elapsed)
+        allowed_tokens = self.tokens.allowed(elapsed)
+        return (f"{self.model}: {self.request_count}/{allowed_requests:.0f} requests allowed at {self.rpm} RPM "
+                f"({self.request_count / allowed_requests:.0%}), "
+                f"{self.token_count}/{allowed_tokens:.0f} tokens allowed at {self.tpm} TPM "
+                f"({self.token_count / allowed_tokens:.0%})")
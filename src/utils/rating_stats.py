@@ -0,0 +1,195 @@
+"""Vectorized statistics over the rating columns of documented samples.
+
+Ratings of all models are aligned in one (rows x models) matrix with a validity
+mask, so paired comparisons only use rows where both models have a valid rating.
+
+Run from the repository root to compare all documented languages:
+    python -m src.utils.rating_stats --output data/rating_stats.csv
+"""
+import argparse
+import itertools
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+RATING_COLUMNS = ['Rating Ref', 'Rating GPT 3', 'Rating GPT 3.5', 'Rating GPT 4']
+TABLE_COLUMNS = ['language', 'model_a', 'model_b', 'n', 'mean_a', 'mean_b', 'mean_difference', 'ci_low', 'ci_high',
+                 't_statistic', 't_p_value', 'wilcoxon_statistic', 'wilcoxon_p_value']
+
+
+def rating_matrix(df: pd.DataFrame, columns: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Align the rating columns of df
+
+    Args:
+        df (pd.DataFrame): Table with one rating column per model, -1 or missing for invalid ratings
+        columns (List[str]): Rating columns, missing ones count as all invalid
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (rows x models) float ratings and the mask of valid ratings
+    """
+    ratings = np.full((len(df), len(columns)), np.nan)
+    for index, column in enumerate(columns):
+        if column in df.columns:
+            ratings[:, index] = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=float)
+    valid = ~np.isnan(ratings) & (ratings > -1)
+    return ratings, valid
+
+
+def bootstrap_mean_ci(values: np.ndarray, n_resamples: int = 2000, confidence: float = 0.95,
+                      rng: Optional[np.random.Generator] = None) -> Tuple[float, float]:
+    """Percentile bootstrap confidence interval of the mean
+
+    A resample of n values only matters through how often it draws each distinct
+    value, so all resamples are drawn at once as multinomial counts over the
+    distinct values. For ratings, which take at most 101 values, this costs
+    (resamples x distinct values) instead of (resamples x rows).
+
+    Args:
+        values (np.ndarray): Sample
+        n_resamples (int): Number of bootstrap resamples
+        confidence (float): Coverage of the interval
+        rng (Optional[np.random.Generator]): Random generator, seeded with 0 if None
+
+    Returns:
+        Tuple[float, float]: Lower and upper bound, nan for an empty sample
+    """
+    if len(values) == 0:
+        return np.nan, np.nan
+    rng = rng if rng is not None else np.random.default_rng(0)
+    distinct, counts = np.unique(values, return_counts=True)
+    draws = rng.multinomial(len(values), counts / len(values), size=n_resamples)
+    means = draws @ distinct / len(values)
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(means, [tail, 100 - tail])
+    return float(low), float(high)
+
+
+def paired_tests(differences: np.ndarray) -> Dict[str, np.ndarray]:
+    """Paired t-tests and Wilcoxon signed-rank tests on every column at once
+
+    Args:
+        differences (np.ndarray): (rows x pairs) differences, nan where a row is not paired
+
+    Returns:
+        Dict[str, np.ndarray]: Per pair n, mean difference, t statistic/p-value and
+            Wilcoxon statistic/p-value (normal approximation, zero differences dropped,
+            nan without nonzero differences)
+    """
+    paired = ~np.isnan(differences)
+    n = paired.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.nansum(differences, axis=0) / n
+        variance = np.nansum((differences - mean) ** 2, axis=0) / (n - 1)
+        t_statistic = mean / np.sqrt(variance / n)
+        t_p_value = 2 * stats.t.sf(np.abs(t_statistic), n - 1)
+
+        # signed ranks of the absolute nonzero differences
+        absolute = np.where(differences == 0, np.nan, np.abs(differences))
+        ranks = stats.rankdata(absolute, axis=0, nan_policy='omit')
+        n_ranked = (~np.isnan(absolute)).sum(axis=0)
+        rank_plus = np.nansum(np.where(differences > 0, ranks, 0), axis=0)
+        rank_minus = n_ranked * (n_ranked + 1) / 2 - rank_plus
+        expected = n_ranked * (n_ranked + 1) / 4
+        tie_correction = np.array([_tie_term(absolute[:, column]) for column in range(absolute.shape[1])])
+        deviation = np.sqrt(n_ranked * (n_ranked + 1) * (2 * n_ranked + 1) / 24 - tie_correction / 48)
+        z = (rank_plus - expected) / deviation
+        wilcoxon_p_value = 2 * stats.norm.sf(np.abs(z))
+    return {
+        'n': n,
+        'mean_difference': mean,
+        't_statistic': t_statistic,
+        't_p_value': t_p_value,
+        # no nonzero differences leave nothing to rank, a statistic of 0 would read as significant
+        'wilcoxon_statistic': np.where(n_ranked > 0, np.minimum(rank_plus, rank_minus), np.nan),
+        'wilcoxon_p_value': wilcoxon_p_value,
+    }
+
+
+def _tie_term(column: np.ndarray) -> float:
+    """Sum of t^3 - t over the groups of t tied values"""
+    _, counts = np.unique(column[~np.isnan(column)], return_counts=True)
+    return float(np.sum(counts ** 3 - counts))
+
+
+def rating_table(df: pd.DataFrame, columns: List[str] = RATING_COLUMNS, language: str = "",
+                 n_resamples: int = 2000, confidence: float = 0.95, seed: int = 0) -> pd.DataFrame:
+    """Tidy table of per-model means and all pairwise model comparisons
+
+    Rows with an empty model_b describe a single model, ci_low/ci_high then bound
+    its mean. The other rows compare model_a with model_b on the rows valid in
+    both, ci_low/ci_high then bound the mean difference a - b.
+
+    Args:
+        df (pd.DataFrame): Table with the rating columns
+        columns (List[str]): Rating columns to compare
+        language (str): Value of the language column
+        n_resamples (int): Bootstrap resamples per confidence interval
+        confidence (float): Coverage of the confidence intervals
+        seed (int): Seed of the bootstrap
+
+    Returns:
+        pd.DataFrame: One row per model and per model pair with TABLE_COLUMNS
+    """
+    rng = np.random.default_rng(seed)
+    ratings, valid = rating_matrix(df, columns)
+    rows = []
+    for index, column in enumerate(columns):
+        values = ratings[valid[:, index], index]
+        low, high = bootstrap_mean_ci(values, n_resamples, confidence, rng)
+        rows.append({'language': language, 'model_a': column, 'model_b': "", 'n': len(values),
+                     'mean_a': values.mean() if len(values) else np.nan, 'ci_low': low, 'ci_high': high})
+
+    pairs = list(itertools.combinations(range(len(columns)), 2))
+    if pairs:
+        first, second = np.array(pairs).T
+        both_valid = valid[:, first] & valid[:, second]
+        differences = np.where(both_valid, ratings[:, first] - ratings[:, second], np.nan)
+        tests = paired_tests(differences)
+        for pair, (a, b) in enumerate(pairs):
+            paired_rows = both_valid[:, pair]
+            low, high = bootstrap_mean_ci(differences[paired_rows, pair], n_resamples, confidence, rng)
+            row = {'language': language, 'model_a': columns[a], 'model_b': columns[b],
+                   'mean_a': ratings[paired_rows, a].mean() if paired_rows.any() else np.nan,
+                   'mean_b': ratings[paired_rows, b].mean() if paired_rows.any() else np.nan,
+                   'ci_low': low, 'ci_high': high}
+            row.update({key: value[pair] for key, value in tests.items()})
+            rows.append(row)
+    return pd.DataFrame(rows, columns=TABLE_COLUMNS)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--languages', type=str, nargs='+', default=['javascript', 'java', 'python', 'go', 'php', 'ruby'])
+    parser.add_argument("--generated_functions", action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument("--bootstrap_resamples", type=int, default=2000)
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--output", type=str, default=os.sep.join(['data', 'rating_stats.csv']))
+    args = parser.parse_args()
+
+    tables = []
+    for language in args.languages:
+        prefix = "repo-documented_" if args.generated_functions else "documented_"
+        documentation_path = os.sep.join(['data', 'documented', prefix+language+".xlsx"])
+        parquet_path = documentation_path.replace('.xlsx', '.parquet')
+        if os.path.exists(parquet_path):
+            df = pd.read_parquet(parquet_path)
+        elif os.path.exists(documentation_path):
+            df = pd.read_excel(documentation_path)
+        else:
+            print("No documented samples for", language)
+            continue
+        tables.append(rating_table(df, language=language, n_resamples=args.bootstrap_resamples,
+                                   confidence=args.confidence))
+    if not tables:
+        return
+    table = pd.concat(tables, ignore_index=True)
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(table)
+    table.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+import asyncio
+import heapq
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import aiohttp
+import openai
+
+from src.utils.rate_limiter import RateLimiter
+from src.utils.response_cache import ResponseCache
+from src.utils.retry import RATE_LIMIT, RetryPolicy, classify_error, retry_after
+from src.utils.tokens import count_message_tokens
+
+# reserved for replies of requests without max_tokens, e.g. a single rating number
+DEFAULT_COMPLETION_TOKENS = 16
+
+# compact unit of work handed to the engine: (row id, code)
+Task = Tuple[Hashable, str]
+
+
+class WindowUsage:
+    """Measures which fraction of the window's slots sat idle per batch of finished tasks"""
+
+    def __init__(self, concurrency: int, batch_size: int):
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.batch = 0
+        self.finished = 0
+        self.busy_slot_time = 0.0
+        self.elapsed = 0.0
+
+    def track(self, busy_slots: int, duration: float):
+        self.busy_slot_time += busy_slots * duration
+        self.elapsed += duration
+
+    def task_finished(self):
+        self.finished += 1
+        if self.finished >= self.batch_size:
+            self.report()
+
+    def report(self):
+        if self.finished == 0:
+            return
+        self.batch += 1
+        idle = 1 - self.busy_slot_time / (self.concurrency * self.elapsed) if self.elapsed > 0 else 0
+        print(f"Batch {self.batch}: {self.finished} rows in {self.elapsed:.1f}s, idle slot fraction {idle:.1%}")
+        self.finished = 0
+        self.busy_slot_time = 0.0
+        self.elapsed = 0.0
+
+
+class RequestEngine:
+    """Runs chat completion requests on one long-lived event loop and HTTP session.
+
+    The engine keeps at most `concurrency` requests in flight. Tasks are fed from
+    an iterator into a sliding window, so a slow request never holds back the
+    rows behind it and the window stays full across batch boundaries.
+    Responses are served from `cache` when one is given. Retry counts and
+    given up rows are kept per row id in `retries` and `give_ups`. Requests go
+    to `api_base` instead of the OpenAI API when it is set, e.g. to the local
+    mock server (see src.utils.mock_server). With
+    `rate_limit`, every request is admitted by a per-model RPM/TPM limiter
+    (see RateLimiter), where -1 for rpm/tpm selects the model's default limit.
+    The idle fraction of the window is reported every `batch_size` finished tasks.
+    """
+
+    def __init__(self, api_key: str, concurrency: int = 64, cache: Optional[ResponseCache] = None,
+                 retry_policy: Optional[RetryPolicy] = None, rate_limit: bool = True, rpm: int = -1, tpm: int = -1,
+                 batch_size: int = 25, api_base: str = ""):
+        # the mock server does not check keys, so none has to be configured for it
+        self.api_key = api_key if api_key or not api_base else "mock"
+        self.api_base = api_base or None
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.cache = cache
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.rate_limit = rate_limit
+        self.rpm = rpm
+        self.tpm = tpm
+        self.rate_limiters: Dict[str, RateLimiter] = {}
+        self.retries: Dict[Hashable, int] = {}
+        self.give_ups: Dict[Hashable, str] = {}
+        # loop time until which no new requests are sent after a Retry-After
+        self.paused_until = 0.0
+        self.loop = asyncio.new_event_loop()
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.open()
+
+    async def _open_session(self) -> aiohttp.ClientSession:
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        return aiohttp.ClientSession(connector=connector)
+
+    def open(self):
+        """Create the shared HTTP session and hand it to the openai client"""
+        self.session = self.loop.run_until_complete(self._open_session())
+        # tasks copy the current context on creation, so they all reuse this session
+        openai.aiosession.set(self.session)
+
+    def close(self):
+        if self.session is not None:
+            self.loop.run_until_complete(self.session.close())
+            self.session = None
+            openai.aiosession.set(None)
+        self.loop.close()
+        for rate_limiter in self.rate_limiters.values():
+            print(rate_limiter.report())
+        if self.cache is not None:
+            print(self.cache.report())
+            self.cache.close()
+
+    def get_rate_limiter(self, model: str) -> Optional[RateLimiter]:
+        if not self.rate_limit:
+            return None
+        if model not in self.rate_limiters:
+            self.rate_limiters[model] = RateLimiter.for_model(model, self.rpm, self.tpm)
+        return self.rate_limiters[model]
+
+    async def chat_completion(self, **kwargs) -> Any:
+        """Send one ChatCompletion request, waiting for a free slot first.
+        Cached responses are returned without a request.
+
+        Args:
+            **kwargs: Arguments for openai.ChatCompletion.acreate
+
+        Returns:
+            Any: The completion object
+        """
+        if self.cache is not None:
+            key = self.cache.key(dict(kwargs, api_base=self.api_base))
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        rate_limiter = self.get_rate_limiter(kwargs['model'])
+        if rate_limiter is not None:
+            estimated = count_message_tokens(kwargs['messages'], kwargs['model'])
+            estimated += kwargs.get('max_tokens') or DEFAULT_COMPLETION_TOKENS
+            await rate_limiter.acquire(estimated)
+        async with self.semaphore:
+            completion = await openai.ChatCompletion.acreate(api_key=self.api_key, api_base=self.api_base, **kwargs)
+        if rate_limiter is not None:
+            usage = getattr(completion, 'usage', None)
+            rate_limiter.settle(estimated, usage.total_tokens if usage is not None else None)
+        if self.cache is not None:
+            self.cache.put(key, completion)
+        return completion
+
+    def run(self, worker: Callable[[Task], Awaitable[Any]], tasks: Iterable[Task],
+            on_result: Callable[[Hashable, Any], None],
+            on_failure: Optional[Callable[[Hashable, BaseException], None]] = None):
+        """Run worker for every task, reporting each result as soon as it is done.
+
+        A task whose worker raises a retryable error is parked in a delay queue
+        until its backoff has passed, so its slot serves other rows meanwhile.
+
+        Args:
+            worker (Callable[[Task], Awaitable[Any]]): Coroutine function handling one task
+            tasks (Iterable[Task]): (row id, code) tuples, consumed lazily
+            on_result (Callable[[Hashable, Any], None]): Called with (row id, result) per finished task
+            on_failure (Optional[Callable[[Hashable, BaseException], None]]): Called with (row id, error) when a task is given up
+        """
+        self.loop.run_until_complete(self._run(worker, tasks, on_result, on_failure))
+
+    async def _run(self, worker: Callable[[Task], Awaitable[Any]], tasks: Iterable[Task],
+                   on_result: Callable[[Hashable, Any], None],
+                   on_failure: Optional[Callable[[Hashable, BaseException], None]]):
+        task_iterator = iter(tasks)
+        in_flight: Dict[asyncio.Future, Task] = {}
+        # heap of (ready time, sequence number, task) for tasks waiting to be retried
+        delayed: List[Tuple[float, int, Task]] = []
+        sequence = 0
+        exhausted = False
+        usage = WindowUsage(self.concurrency, self.batch_size)
+        while True:
+            while len(in_flight) < self.concurrency and self.loop.time() >= self.paused_until:
+                if delayed and delayed[0][0] <= self.loop.time():
+                    task = heapq.heappop(delayed)[2]
+                elif not exhausted:
+                    try:
+                        task = next(task_iterator)
+                    except StopIteration:
+                        exhausted = True
+                        continue
+                else:
+                    break
+                in_flight[asyncio.ensure_future(worker(task))] = task
+            if not in_flight and not delayed and exhausted:
+                usage.report()
+                break
+            # wake up for a completion, or when the pause ends or a delayed task becomes ready
+            timeout = None
+            if len(in_flight) < self.concurrency:
+                if self.loop.time() < self.paused_until:
+                    timeout = self.paused_until - self.loop.time()
+                elif delayed:
+                    timeout = max(0.0, delayed[0][0] - self.loop.time())
+            waiting_since = self.loop.time()
+            if not in_flight:
+                await asyncio.sleep(timeout)
+                usage.track(0, self.loop.time() - waiting_since)
+                continue
+            done, _ = await asyncio.wait(in_flight, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            usage.track(len(in_flight), self.loop.time() - waiting_since)
+            for future in done:
+                task = in_flight.pop(future)
+                row_id = task[0]
+                error = future.exception()
+                if error is None:
+                    on_result(row_id, future.result())
+                    usage.task_finished()
+                    continue
+                delay = self.retry_delay(row_id, error)
+                if delay is None:
+                    if on_failure is not None:
+                        on_failure(row_id, error)
+                    usage.task_finished()
+                    continue
+                heapq.heappush(delayed, (self.loop.time() + delay, sequence, task))
+                sequence += 1
+
+    def retry_delay(self, row_id: Hashable, error: BaseException) -> Optional[float]:
+        """Count a failed attempt of a row and decide when to retry it
+
+        Args:
+            row_id (Hashable): Row of the failed task
+            error (BaseException): Exception raised by the worker
+
+        Returns:
+            Optional[float]: Seconds until the retry, None if the row is given up
+        """
+        kind = classify_error(error)
+        attempt = self.retries.get(row_id, 0)
+        if not self.retry_policy.should_retry(kind, attempt):
+            print("Giving up on row", row_id, kind, error)
+            self.give_ups[row_id] = kind
+            return None
+        self.retries[row_id] = attempt + 1
+        delay = self.retry_policy.delay(attempt, error)
+        if kind == RATE_LIMIT and retry_after(error) is not None:
+            # the server asked everyone to wait, so hold back new requests too
+            self.paused_until = max(self.paused_until, self.loop.time() + delay)
+        return delay
+
+    async def run_with_retries(self, worker: Callable[[Task], Awaitable[Any]], task: Task) -> Tuple[Any, Optional[BaseException]]:
+        """Await worker(task) with the retry policy of run(), backing off in place.
+
+        Meant for queue driven callers like the pipeline, whose stage workers
+        handle one task at a time anyway.
+
+        Returns:
+            Tuple[Any, Optional[BaseException]]: Result, or the last error if the row was given up
+        """
+        while True:
+            pause = self.paused_until - self.loop.time()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            try:
+                return await worker(task), None
+            except Exception as error:
+                delay = self.retry_delay(task[0], error)
+                if delay is None:
+                    return None, error
+                await asyncio.sleep(delay)
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Optional
+
+from openai.util import convert_to_openai_object
+
+# request parameters that determine the response
+KEY_FIELDS = ['model', 'messages', 'temperature', 'max_tokens', 'stop']
+
+
+class ResponseCache:
+    """On-disk cache of chat completion responses, shared by generation and evaluation.
+
+    Entries are keyed by a hash of the request parameters in KEY_FIELDS and stored
+    in a SQLite database. Entries older than `max_age_days` are dropped, and the
+    least recently used entries are evicted once the cache exceeds `max_mb`.
+    """
+
+    EVICT_EVERY = 500
+
+    def __init__(self, cache_dir: str, max_mb: int = 1024, max_age_days: float = 30):
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.max_bytes = max_mb * 1024 * 1024
+        self.max_age = max_age_days * 24 * 60 * 60
+        self.hits = 0
+        self.misses = 0
+        self.puts_since_evict = 0
+        self.connection = sqlite3.connect(os.sep.join([cache_dir, 'responses.sqlite']), isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created REAL NOT NULL,
+            accessed REAL NOT NULL)''')
+        self.evict()
+
+    def key(self, request: dict) -> str:
+        """Hash the response-relevant parameters of a request
+
+        Args:
+            request (dict): Keyword arguments of the ChatCompletion call
+
+        Returns:
+            str: Hex digest identifying the request
+        """
+        relevant = {field: request.get(field) for field in KEY_FIELDS}
+        # responses of another endpoint, e.g. the mock server, must not mix with real ones
+        if request.get('api_base'):
+            relevant['api_base'] = request['api_base']
+        serialized = json.dumps(relevant, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        row = self.connection.execute('SELECT response, created FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None or time.time() - row[1] > self.max_age:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.connection.execute('UPDATE responses SET accessed = ? WHERE key = ?', (time.time(), key))
+        return convert_to_openai_object(json.loads(row[0]))
+
+    def put(self, key: str, response: Any):
+        serialized = json.dumps(response, ensure_ascii=False)
+        now = time.time()
+        self.connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                                (key, serialized, len(serialized), now, now))
+        self.puts_since_evict += 1
+        if self.puts_since_evict >= self.EVICT_EVERY:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones until the size limit holds"""
+        self.puts_since_evict = 0
+        self.connection.execute('DELETE FROM responses WHERE created < ?', (time.time() - self.max_age,))
+        total_size = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+        evicted = []
+        for key, size in self.connection.execute('SELECT key, size FROM responses ORDER BY accessed'):
+            if total_size <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total_size -= size
+        self.connection.executemany('DELETE FROM responses WHERE key = ?', evicted)
+
+    def report(self) -> str:
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0
+        return f"Cache hits: {self.hits}, misses: {self.misses}, hit rate: {hit_rate:.1%}"
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,78 @@
+import asyncio
+import random
+from typing import Optional
+
+import aiohttp
+import openai
+
+RATE_LIMIT = 'rate_limit'
+TIMEOUT = 'timeout'
+SERVER_ERROR = 'server_error'
+PERMANENT = 'permanent'
+
+
+def classify_error(error: BaseException) -> str:
+    """Sort a failed request into rate limit, timeout, server error or permanent
+
+    Args:
+        error (BaseException): Exception raised by the request
+
+    Returns:
+        str: One of RATE_LIMIT, TIMEOUT, SERVER_ERROR, PERMANENT
+    """
+    if isinstance(error, openai.error.RateLimitError):
+        return RATE_LIMIT
+    if isinstance(error, (openai.error.Timeout, openai.error.APIConnectionError,
+                          asyncio.TimeoutError, aiohttp.ClientError)):
+        return TIMEOUT
+    if isinstance(error, (openai.error.ServiceUnavailableError, openai.error.TryAgain)):
+        return SERVER_ERROR
+    if isinstance(error, openai.error.OpenAIError):
+        status = error.http_status
+        if status == 429:
+            return RATE_LIMIT
+        if status is not None and status >= 500:
+            return SERVER_ERROR
+        if status is None and isinstance(error, openai.error.APIError):
+            return SERVER_ERROR
+    return PERMANENT
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds to wait as requested by the Retry-After header, if the error carries one"""
+    headers = getattr(error, 'headers', None) or {}
+    value = headers.get('retry-after') or headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+class RetryPolicy:
+    """Jittered exponential backoff that honors Retry-After"""
+
+    def __init__(self, max_retries: int = 8, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, kind: str, attempt: int) -> bool:
+        return kind != PERMANENT and attempt < self.max_retries
+
+    def delay(self, attempt: int, error: BaseException) -> float:
+        """Backoff before the next attempt
+
+        Args:
+            attempt (int): Number of retries already made for the task
+            error (BaseException): Exception of the last attempt
+
+        Returns:
+            float: Delay in seconds
+        """
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        server_delay = retry_after(error)
+        if server_delay is not None:
+            return max(server_delay, backoff)
+        return backoff
@@ -3,90 +3,133 @@ import os
 import re
 import sys
 import time
-from typing import List, TypedDict
-
-import pandas as pd
-import tiktoken
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Callable, Iterable, Iterator, List, Mapping, Optional, Tuple
 
 from src.utils.argparser import Arguments
-from src.utils.language_utils.base import LanguageUtil
-from src.utils.language_utils.java import JavaUtils
-from src.utils.language_utils.javascript import JavascriptUtils
-from src.utils.language_utils.python import PythonUtils
+from src.utils.function_sink import FunctionSink
+from src.utils.mining_state import MiningState
+from src.utils.language_utils import get_language_util
+from src.utils.language_utils.base import FunctionRecord, LanguageUtil
+
+
+def extract_file(language: str, file_path: str, preprocessed_path: Optional[str] = None) -> List[FunctionRecord]:
+    """Strip the comments of one file and extract its functions in memory, picklable for the process pool
+
+    Args:
+        language (str): Language of the file
+        file_path (str): Source file
+        preprocessed_path (Optional[str]): Also write the comment-free source there, for debugging
+
+    Returns:
+        List[FunctionRecord]: Extracted function codes and their token counts
+    """
+    language_util = get_language_util(language)
+    # a file that is not UTF-8 still yields its functions, with undecodable bytes replaced
+    with open(file_path, "r", encoding="utf-8", errors="replace") as file:
+        source = language_util.remove_comments(file.read())
+    if preprocessed_path is not None:
+        os.makedirs(os.path.dirname(preprocessed_path), exist_ok=True)
+        with open(preprocessed_path, "w") as preprocessed_file:
+            preprocessed_file.write(source)
+    return language_util.extract_function_records(source)
+
+def write_functions(sink: FunctionSink, state: MiningState, repo_name: str,
+                    files: Iterable[Tuple[str, List[FunctionRecord]]], blobs: Optional[Mapping[str, str]] = None):
+    """Append the functions of a repo's files to the sink and mark the files finished
+
+    Args:
+        sink (FunctionSink): Shards the functions are written to
+        state (MiningState): Mining progress the files are marked finished in
+        repo_name (str): Repo of the files
+        files (Iterable[Tuple[str, List[FunctionRecord]]]): File paths inside the repo and their functions
+        blobs (Optional[Mapping[str, str]]): Git blob SHA per file path, indexed with the finished files
+    """
+    finished_files = []
+    for file, functions in files:
+        sink.append(repo_name, file, functions)
+        finished_files.append((file, len(functions)))
+        if sink.shard_format == 'jsonl':
+            # JSONL shards are written right away, Parquet shards only by finish_repo
+            state.set_files_finished(repo_name, finished_files, blobs)
+            finished_files = []
+    sink.finish_repo(repo_name)
+    state.set_files_finished(repo_name, finished_files, blobs)
 
+class FunctionSplitter():
+    language_util: LanguageUtil
 
-class Function(TypedDict):
-    repo: str
-    path: str
-    code: str
+    def __init__(self, args: Arguments, repo_name: str, repo_path: str, files: list[str],
+                 sink: Optional[FunctionSink] = None, state: Optional[MiningState] = None):
+        self.language_util = get_language_util(args.language)
 
-enc = tiktoken.encoding_for_model("gpt-3.5-turbo")
+        self.language = args.language
+        self.repo_name = repo_name
+        self.repo_path = repo_path
+        self.files = files
+        self.workers = args.extraction_workers if args.extraction_workers > 0 else os.cpu_count()
+        self.chunk_size = args.extraction_chunk_size
+        self.keep_preprocessed = args.keep_preprocessed
 
-class FunctionSplitter():
-    language_util: LanguageUtil
+        if sink is None:
+            return
+        if state is None:
+            raise ValueError("FunctionSplitter needs a MiningState to write to a FunctionSink")
 
-    def __init__(self, args: Arguments, repo_name: str, repo_path: str, files: list[str]):
-        if args.language == "javascript":
-            self.language_util = JavascriptUtils()
-        elif args.language == "python":
-            self.language_util = PythonUtils()
-        elif args.language == "java":
-            self.language_util = JavaUtils()
-        else:
-            raise NotImplementedError("Language not implemented")
+        write_functions(sink, state, repo_name, self.split_files(lambda file: state.is_file_finished(repo_name, file)))
 
-        samples_path = os.sep.join(['data','raw', 'repo-samples_' + args.language + '.xlsx'])
-        
-        if os.path.exists(samples_path):
-            samples_df = pd.read_excel(samples_path)
-        else:
-            samples_df = pd.DataFrame(columns=['repo', 'path', 'code'])
+    def split_files(self, is_finished: Optional[Callable[[str], bool]] = None) -> Iterator[Tuple[str, List[FunctionRecord]]]:
+        """Extract the functions of every file of the repo
+
+        With more than one extraction worker, files are fanned out over a process
+        pool in chunks of `extraction_chunk_size`; results are still yielded in the
+        order of self.files.
 
-        for file in files:
-            file_path = os.sep.join([repo_path, file])
-            file_name = os.path.basename(file)
+        Args:
+            is_finished (Optional[Callable[[str], bool]]): Files for which it returns True are skipped
+
+        Yields:
+            Tuple[str, List[FunctionRecord]]: File path inside the repo and its function codes with token counts
+        """
+        jobs: List[Tuple[str, str, Optional[str]]] = []
+        for file in self.files:
+            file_path = os.sep.join([self.repo_path, file])
 
             if not os.path.exists(file_path):
                 print(f"FILE_PATH {file_path} does not exist, aborting")
                 sys.exit(os.EX_USAGE)
 
-            preprocessed_folder = os.sep.join(['preprocessed', repo_name])
-            preprocessed_path = os.sep.join([preprocessed_folder, file_name])
-
-            if not os.path.exists(preprocessed_folder):
-                os.makedirs(preprocessed_folder)
-
-            if self.is_file_already_finished(samples_df, file, repo_name):
+            if is_finished is not None and is_finished(file):
                 print(f"FILE {file_path} already finished")
                 continue
             
             if not os.path.isfile(file_path):
                 continue
 
-            if not os.path.exists(preprocessed_path):
-                self.preprocess_file(file_path, preprocessed_path)
-
-            function_codes: List[str] = self.language_util.extract_functions_from_file(preprocessed_path)
-            functions: List[Function] = map(lambda code: {"repo": repo_name, "path": file, "code": code}, function_codes)
-            df_extended = pd.DataFrame(functions, columns=['repo', 'path', 'code'])
-            samples_df = pd.concat([samples_df, df_extended], ignore_index=True)
-            samples_df.to_excel(samples_path, index=False)                
-
-    def preprocess_file(self, file_path: str, preprocessed_path:str):
-        with open(file_path, "r") as file:
-            file_content = file.read()
-            replacement_result = self.language_util.remove_comments(file_content)
-            with open(preprocessed_path, "w") as preprossedFile:
-                preprossedFile.write(replacement_result)
-
-    def is_file_already_finished(self,samples_df: pd.DataFrame, path: str, repo_name: str)-> bool:
-        """checks if file path is already included in xlsx dataframe -> file is already finished then
-
-        Args:
-            samples_df (pd.DataFrame): XLSX Dataframe
-            path (str): file path
-
-        Returns:
-            bool: wheter it is already included
-        """
-        return ((samples_df['path'] == path) & (samples_df['repo'] == repo_name)).any()
\ No newline at end of file
+            # the full path inside the repo keeps files with the same name apart
+            preprocessed_path = os.sep.join(['preprocessed', self.repo_name, file]) if self.keep_preprocessed else None
+            jobs.append((file, file_path, preprocessed_path))
+
+        started = time.perf_counter()
+        function_count = 0
+        files = [file for file, _, _ in jobs]
+        file_paths = [file_path for _, file_path, _ in jobs]
+        preprocessed_paths = [preprocessed_path for _, _, preprocessed_path in jobs]
+        if self.workers == 1 or len(jobs) <= 1:
+            results = map(extract_file, repeat(self.language), file_paths, preprocessed_paths)
+            executor = None
+        else:
+            executor = ProcessPoolExecutor(self.workers)
+            results = executor.map(extract_file, repeat(self.language), file_paths, preprocessed_paths,
+                                   chunksize=self.chunk_size)
+        try:
+            for file, functions in zip(files, results):
+                function_count += len(functions)
+                yield file, functions
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        print(f"{self.repo_name}: {len(jobs)} files, {function_count} functions in {elapsed:.1f}s "
+              f"({len(jobs) / elapsed:.1f} files/s, {function_count / elapsed:.1f} functions/s)")
@@ -0,0 +1,102 @@
+from functools import lru_cache
+from typing import List, Mapping, Optional, Sequence, Tuple
+
+import pandas as pd
+import tiktoken
+
+# tokens added by the chat format around every message and the reply
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+# extracted functions with this many tokens or more are dropped
+MAX_FUNCTION_TOKENS = 2500
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str = "gpt-3.5-turbo") -> tiktoken.Encoding:
+    """Load the tiktoken encoder of a model once and share it"""
+    return tiktoken.encoding_for_model(model)
+
+
+@lru_cache(maxsize=None)
+def max_token_bytes(model: str = "gpt-3.5-turbo") -> int:
+    """Length in bytes of the longest token of the model's vocabulary"""
+    return max(len(token) for token in get_encoding(model).token_byte_values())
+
+
+def token_counts(codes: Sequence[str], model: str = "gpt-3.5-turbo", known: Optional[Sequence] = None) -> List[int]:
+    """Token count per code, encoding only the codes without a known count
+
+    Args:
+        codes (Sequence[str]): Codes to count
+        model (str): Model whose encoder is used
+        known (Optional[Sequence]): Counts kept from an earlier stage, None or NaN where missing
+
+    Returns:
+        List[int]: Number of tokens per code
+    """
+    counts = [None] * len(codes) if known is None else [None if pd.isna(count) else int(count) for count in known]
+    missing = [index for index, count in enumerate(counts) if count is None]
+    if missing:
+        encoded = get_encoding(model).encode_batch([codes[index] for index in missing])
+        for index, tokens in zip(missing, encoded):
+            counts[index] = len(tokens)
+    return counts
+
+
+def cap_tokens(codes: Sequence[str], max_tokens: int = MAX_FUNCTION_TOKENS,
+               model: str = "gpt-3.5-turbo") -> List[Tuple[str, Optional[int]]]:
+    """Keep the codes with fewer than max_tokens tokens, encoding only the borderline ones.
+
+    Every token is at least one and at most max_token_bytes bytes long, so a code
+    with fewer UTF-8 bytes than max_tokens is kept and one with at least
+    max_tokens * max_token_bytes bytes is dropped without encoding it. The codes
+    in between are encoded together with encode_batch.
+
+    Args:
+        codes (Sequence[str]): Candidate codes
+        max_tokens (int): Exclusive token limit
+        model (str): Model whose encoder is used
+
+    Returns:
+        List[Tuple[str, Optional[int]]]: Kept codes in order with their token count, None where it was not computed
+    """
+    byte_counts = [len(code.encode('utf-8')) for code in codes]
+    borderline = [index for index, byte_count in enumerate(byte_counts)
+                  if max_tokens <= byte_count < max_tokens * max_token_bytes(model)]
+    counts = dict(zip(borderline, token_counts([codes[index] for index in borderline], model))) if borderline else {}
+    functions = []
+    for index, code in enumerate(codes):
+        if byte_counts[index] < max_tokens:
+            functions.append((code, None))
+        elif index in counts and counts[index] < max_tokens:
+            functions.append((code, counts[index]))
+    return functions
+
+
+def count_message_tokens(messages: list[dict], model: str = "gpt-3.5-turbo") -> int:
+    """Count the prompt tokens of a chat message list
+
+    Args:
+        messages (list[dict]): Chat messages with role and content
+        model (str): Model whose encoder is used
+
+    Returns:
+        int: Number of prompt tokens
+    """
+    enc = get_encoding(model)
+    return sum(TOKENS_PER_MESSAGE + len(enc.encode(message['content'])) for message in messages) + TOKENS_PER_REPLY
+
+
+def order_longest_first(tasks, model: str = "gpt-3.5-turbo", known_counts: Optional[Mapping] = None) -> list:
+    """Sort (row id, code) tasks by descending token count of the code.
+
+    Dispatching the most expensive rows first keeps long requests from being
+    the last ones running while the rest of the window sits idle. Rows in
+    known_counts, such as counts kept by the function extraction, are not
+    encoded again.
+    """
+    tasks = list(tasks)
+    known = None if known_counts is None else [known_counts.get(row_id) for row_id, _ in tasks]
+    counts = token_counts([code for _, code in tasks], model, known)
+    order = sorted(range(len(tasks)), key=lambda index: counts[index], reverse=True)
+    return [tasks[index] for index in order]